@@ -6,27 +6,51 @@ from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer
 from flask_admin import Admin, AdminIndexView
 from flask_admin.contrib.sqla import ModelView
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 
 app = Flask(__name__)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../fyt.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///../fyt.db'
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE') or 5)
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW') or 10)
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT') or 30)
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH') or 16 * 1024 * 1024)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+app.config['PASSWORD_HASHER'] = os.environ.get('PASSWORD_HASHER') or 'scrypt'
+app.config['PASSWORD_PBKDF2_ITERATIONS'] = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS') or 260000)
+app.config['PASSWORD_SCRYPT_N'] = int(os.environ.get('PASSWORD_SCRYPT_N') or 2 ** 14)
+app.config['PASSWORD_SCRYPT_R'] = int(os.environ.get('PASSWORD_SCRYPT_R') or 8)
+app.config['PASSWORD_SCRYPT_P'] = int(os.environ.get('PASSWORD_SCRYPT_P') or 1)
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
 app.config['MAIL_PORT'] = os.environ.get('MAIL_PORT')
 app.config['MAIL_USE_SSL'] = True
 app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_SENDER'] = 'FYT Admin <{0}>'.format(app.config['MAIL_USERNAME'])
+app.config['MAIL_QUEUE_SCHEDULER'] = os.environ.get('MAIL_QUEUE_SCHEDULER')
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# proxies in front of the app, e.g. 1 behind the Heroku router; their
+# X-Forwarded-* headers are trusted to give the client's address
+app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS') or 0)
 app.config['GOOGLE_MAP_API_KEY'] = os.environ.get('GOOGLE_MAP_API_KEY')
 app.config['OPENCAGE_GEOCODE_API_KEY'] = os.environ.get("OPENCAGE_GEOCODE_API_KEY")
 
+if app.config['PROXY_FIX_HOPS']:
+    hops = app.config['PROXY_FIX_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
 # set optional bootswatch theme
 
 app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
 
 db = SQLAlchemy(app)
+from . import database
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
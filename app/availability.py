@@ -0,0 +1,148 @@
+import hashlib
+import math
+import threading
+import time
+
+from sqlalchemy import event, func, select
+
+from . import app, db
+from .models import User
+from .ratelimit import TokenBucketLimiter
+
+
+app.config.setdefault('AVAILABILITY_FALSE_POSITIVE_RATE', 0.01)
+# new rows from other workers are picked up this often; a full rebuild,
+# which also sees renames made elsewhere, bounds how long those are missed
+app.config.setdefault('AVAILABILITY_SYNC_SECONDS', 5)
+app.config.setdefault('AVAILABILITY_REBUILD_SECONDS', 60)
+app.config.setdefault('AVAILABILITY_CHECK_RATE', 5.0)
+app.config.setdefault('AVAILABILITY_CHECK_BURST', 20)
+
+_user = User.__table__
+
+
+class BloomFilter:
+    """
+    A set that can answer "definitely not present" or "possibly present":
+    `capacity` values fill it to roughly `error_rate` false positives.
+    Values cannot be removed.
+    """
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1024)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        # double hashing: k positions from two 64 bit hashes
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TakenNames:
+    """
+    Bloom filters of the usernames and emails in use, so an availability
+    check only queries the database when the name is possibly taken.
+
+    The filters are built on first use and kept current by this process's
+    flushes. Rows inserted by other workers are caught up every
+    AVAILABILITY_SYNC_SECONDS; each catch-up rereads the ids since the one
+    before it, so a row committed after a higher id was read is found one
+    catch-up late. Rows committed later than that, and names other workers
+    rename users to, are reported available until the next rebuild, at
+    most AVAILABILITY_REBUILD_SECONDS later; the registration form still
+    checks the database. Deleted and renamed users leave
+    stale entries, which only cost a query. The filters are also rebuilt
+    once those pile up or the filters fill.
+    """
+
+    COLUMNS = ('username', 'email')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._filters = None
+        self._last_id = self._synced_id = 0
+        self._stale = 0
+        self._synced = self._built = 0.0
+
+    def _build(self, connection):
+        count = connection.execute(select([func.count()]).select_from(_user)).scalar()
+        error_rate = app.config['AVAILABILITY_FALSE_POSITIVE_RATE']
+        # room to grow before the next rebuild
+        filters = {column: BloomFilter(2 * count, error_rate) for column in self.COLUMNS}
+        last_id = self._add_rows(connection, filters, 0)
+        self._filters, self._last_id, self._synced_id, self._stale = filters, last_id, last_id, 0
+        self._synced = self._built = time.monotonic()
+
+    def _add_rows(self, connection, filters, after_id):
+        last_id = after_id
+        for row in connection.execute(
+                select([_user.c.id, _user.c.username, _user.c.email]).where(_user.c.id > after_id)):
+            for column in self.COLUMNS:
+                # catch-ups overlap; don't count a name twice towards the capacity
+                if row[column] is not None and row[column] not in filters[column]:
+                    filters[column].add(row[column])
+            last_id = max(last_id, row.id)
+        return last_id
+
+    def _current(self, connection):
+        now = time.monotonic()
+        if (self._filters is None
+                or now - self._built > app.config['AVAILABILITY_REBUILD_SECONDS']
+                or self._stale > self._filters['username'].capacity // 10
+                or self._filters['username'].count > self._filters['username'].capacity):
+            self._build(connection)
+        elif now - self._synced > app.config['AVAILABILITY_SYNC_SECONDS']:
+            # rows below the last id seen may commit late, so overlap the previous catch-up
+            last_id = self._add_rows(connection, self._filters, self._synced_id)
+            self._synced_id, self._last_id = self._last_id, max(last_id, self._last_id)
+            self._synced = now
+        return self._filters
+
+    def possibly_taken(self, column, value):
+        """ False when no user has `value` as their `column` """
+        with self._lock:
+            return value in self._current(db.session.connection())[column]
+
+    def is_taken(self, column, value):
+        """ Whether a user has `value` as their `column`; queries only on a possible hit """
+        if not self.possibly_taken(column, value):
+            return False
+        return db.session.query(User.query.filter(getattr(User, column) == value).exists()).scalar()
+
+    def track(self, session):
+        """ Add the names of users written in this flush, count the ones that went away """
+        with self._lock:
+            if self._filters is None:
+                return
+            for obj in session.new | session.dirty:
+                if isinstance(obj, User):
+                    state = db.inspect(obj)
+                    for column in self.COLUMNS:
+                        history = getattr(state.attrs, column).history
+                        for value in history.added:
+                            if value is not None:
+                                self._filters[column].add(value)
+                        self._stale += len(history.deleted)
+            self._stale += sum(isinstance(obj, User) for obj in session.deleted)
+
+
+taken_names = TakenNames()
+availability_checks = TokenBucketLimiter(app.config['AVAILABILITY_CHECK_RATE'], app.config['AVAILABILITY_CHECK_BURST'])
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_taken_names(session, flush_context):
+    taken_names.track(session)
@@ -0,0 +1,109 @@
+import time
+import threading
+
+from flask import g
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import app, db
+from .models import Student, Tutor
+from .pictures import fetch_profile_pic
+
+
+app.config.setdefault('PROFILE_CONTEXT_TTL', 30)
+app.config.setdefault('PROFILE_CONTEXT_CACHE_SIZE', 4096)
+
+
+class ProfileCache:
+    """
+    Column values of Student/Tutor rows by user id, kept for `ttl` seconds.
+
+    Rows are stored as plain values, not ORM objects, so entries can be
+    shared between requests and sessions. Updates in this process
+    invalidate an entry straight away; the TTL bounds how long other
+    workers can serve a stale profile.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1], entry[2]
+
+    def set(self, user_id, cls, values):
+        with self._lock:
+            if len(self._entries) >= self.size:
+                now = time.monotonic()
+                for key in [key for key, entry in self._entries.items() if entry[0] < now]:
+                    del self._entries[key]
+                if len(self._entries) >= self.size:
+                    self._entries.clear()
+            self._entries[user_id] = (time.monotonic() + self.ttl, cls, values)
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+
+profile_cache = ProfileCache(app.config['PROFILE_CONTEXT_TTL'], app.config['PROFILE_CONTEXT_CACHE_SIZE'])
+
+
+def _load_profile(user):
+    """ The user's Student or Tutor row, from the cache when possible """
+    if user.role not in ('student', 'tutor'):
+        return None
+    cached = profile_cache.get(user.id)
+    if cached is None:
+        profile = getattr(user, user.role)
+        if profile is not None:
+            values = {attr.key: getattr(profile, attr.key) for attr in db.inspect(profile).mapper.column_attrs}
+            profile_cache.set(user.id, type(profile), values)
+        return profile
+    cls, values = cached
+    profile = cls(**values)
+    # attach as a clean persistent object, without a SELECT
+    make_transient_to_detached(profile)
+    profile = db.session.merge(profile, load=False)
+    set_committed_value(user, user.role, profile)
+    return profile
+
+
+class ProfileContext:
+    """ The current user, their Student/Tutor row and avatar URL """
+
+    def __init__(self, user):
+        self.user = user
+        self.profile = _load_profile(user)
+        self._avatar = None
+
+    @property
+    def avatar(self):
+        # resolved on first use: it depends on the profile picture, which the
+        # request may change before rendering
+        profile_pic = getattr(self.profile, 'profile_pic', None)
+        if self._avatar is None or self._avatar[0] != profile_pic:
+            self._avatar = (profile_pic, fetch_profile_pic(self.profile))
+        return self._avatar[1]
+
+
+def profile_context():
+    """ ProfileContext of the logged in user, built once per request """
+    context = g.get('profile_context')
+    if context is None:
+        context = g.profile_context = ProfileContext(current_user._get_current_object())
+    return context
+
+
+@event.listens_for(Student, 'after_update')
+@event.listens_for(Student, 'after_delete')
+@event.listens_for(Tutor, 'after_update')
+@event.listens_for(Tutor, 'after_delete')
+def _invalidate_profile(mapper, connection, target):
+    profile_cache.invalidate(target.user_id)
@@ -0,0 +1,61 @@
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+
+from . import app
+
+
+# WAL lets readers run alongside the single writer and turns commits into
+# appends to the log; synchronous=NORMAL only fsyncs at checkpoints, which is
+# still safe against corruption in WAL mode.
+app.config.setdefault('SQLITE_PRAGMAS', {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+    'mmap_size': app.config['SQLITE_MMAP_SIZE'],
+    'temp_store': 'MEMORY',
+})
+
+
+def engine_options(uri):
+    """ SQLALCHEMY_ENGINE_OPTIONS for the database behind `uri` """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        # pysqlite's own lock timeout, matched to the busy_timeout pragma
+        options = {'connect_args': {'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+        if url.database and url.database != ':memory:':
+            # keep file connections open (and their page cache and mmap)
+            # instead of reconnecting for every request
+            options['poolclass'] = QueuePool
+            options['pool_size'] = app.config['DB_POOL_SIZE']
+            options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+            options['connect_args']['check_same_thread'] = False
+        return options
+    return {
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """ Run SQLITE_PRAGMAS on every new SQLite connection """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+    cursor.close()
+
+
+# options set explicitly in SQLALCHEMY_ENGINE_OPTIONS take priority
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+    engine_options(app.config['SQLALCHEMY_DATABASE_URI']),
+    **app.config['SQLALCHEMY_ENGINE_OPTIONS']
+)
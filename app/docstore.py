@@ -0,0 +1,52 @@
+import os
+
+from . import app, db
+from .models import DocumentBlob
+from .uploads import spool_upload, move_into_place
+
+DOCS_ROOT = os.path.join(app.root_path, 'static', 'docs')
+
+
+def _blob_name(digest, extension):
+    # two hex characters of prefix give 256 shard directories per document type
+    return '{0}/{1}{2}'.format(digest[:2], digest, extension.lower())
+
+
+def save_document(upload, directory):
+    """
+    Store an uploaded file under static/docs/<directory> by its SHA-256 and
+    return its name relative to that directory.
+
+    The upload is hashed while it is streamed to a temporary file, then moved
+    into place. Identical files share one copy on disk and one
+    reference-counted DocumentBlob row. Raises UploadRejected past
+    DOCS_MAX_BYTES.
+    """
+    root = os.path.join(DOCS_ROOT, directory)
+    temp_path, digest = spool_upload(upload, root, app.config['DOCS_MAX_BYTES'])
+    name = _blob_name(digest, os.path.splitext(upload.filename)[1])
+    move_into_place(temp_path, os.path.join(root, name))
+
+    blob = DocumentBlob.query.filter_by(directory=directory, name=name).first()
+    if blob is None:
+        db.session.add(DocumentBlob(directory=directory, name=name, ref_count=1))
+    else:
+        blob.ref_count = DocumentBlob.ref_count + 1
+    return name
+
+
+def delete_document(name, directory):
+    """ Drop one reference to a stored file, unlinking it with the last one """
+    blob = DocumentBlob.query.filter_by(directory=directory, name=name).first()
+    if blob is not None:
+        DocumentBlob.query.filter_by(id=blob.id).update(
+            {DocumentBlob.ref_count: DocumentBlob.ref_count - 1}, synchronize_session=False)
+        db.session.refresh(blob)
+        if blob.ref_count > 0:
+            return
+        db.session.delete(blob)
+    # files saved before the blob store have no row and a single owner
+    try:
+        os.remove(os.path.join(DOCS_ROOT, directory, name))
+    except FileNotFoundError:
+        pass
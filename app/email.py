@@ -2,6 +2,7 @@ from flask import render_template, url_for
 from flask_mail import Message
 
 from . import app, mail, ser
+from .mailqueue import enqueue, queue_broadcast
 
 
 def send_registration_mail(user):
@@ -13,7 +14,7 @@ def send_registration_mail(user):
         )
     msg.html = render_template('email-templates/registration-mail.html', username=user.username, 
         role=user.role, sending_mail=True, email=app.config.get('MAIL_USERNAME'), user=user, token=token)
-    mail.send(msg)
+    enqueue(msg)
 
 def send_reset_mail(user):
     token = user.get_reset_token(expires_sec=1800)
@@ -23,14 +24,8 @@ def send_reset_mail(user):
             recipients=[user.email]
         )
     msg.html = render_template('email-templates/pwd-reset-mail.html', user=user, token=token)
-    mail.send(msg)
+    enqueue(msg)
 
 
-def send_announcements_mail(title, message, email_list):
-    msg = Message(
-            f'[Find Your Tutor] {title}',
-            sender=app.config.get('MAIL_SENDER'),
-            recipients=[*email_list]
-        )
-    msg.body = message
-    mail.send(msg)
\ No newline at end of file
+def send_announcements_mail(title, message):
+    return queue_broadcast(title, message)
\ No newline at end of file
@@ -141,4 +141,9 @@ class MyAchievementForm(FlaskForm):
     awarded_by = StringField("Awarded By",[DataRequired()])
     awarded_date = DateField("Awarded Date", [DataRequired()])
     achievement_certificate = FileField("Certification for your achievement", validators=[FileRequired(), FileAllowed(['pdf','docx','doc','png','jpeg','jpg'], 'File format must be .pdf, .docx, .doc, .png, .jpeg or .jpg!')])
-    save_achievement = SubmitField("Save")
\ No newline at end of file
+    save_achievement = SubmitField("Save")
+
+
+# no fields beyond the CSRF token
+class SqlProfileResetForm(FlaskForm):
+    reset = SubmitField('Reset')
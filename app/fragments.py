@@ -0,0 +1,141 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from flask import render_template, request, session
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from werkzeug.http import is_resource_modified
+
+from . import app, db
+from .models import Course
+
+
+app.config.setdefault('FRAGMENT_CACHE_SIZE', 256)
+app.config.setdefault('FRAGMENT_CACHE_STAMP', os.path.join(app.instance_path, 'fragment-cache.stamp'))
+
+Fragment = namedtuple('Fragment', 'html etag last_modified')
+
+
+class FragmentCache:
+    """
+    LRU cache of rendered HTML fragments, at most `size` entries.
+
+    `invalidate` empties it and touches a stamp file; every lookup compares
+    the stamp's mtime with the one seen at the last lookup, so an edit in
+    one worker empties the cache of every worker on the host. A render that
+    was started before an invalidation is not stored.
+    """
+
+    def __init__(self, size, stamp):
+        self.size = size
+        self.stamp = stamp
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stamp_mtime = self._read_stamp()
+
+    def _read_stamp(self):
+        try:
+            return os.stat(self.stamp).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, key, render):
+        """ The fragment for `key`, calling `render()` for its HTML on a miss """
+        mtime = self._read_stamp()
+        with self._lock:
+            if mtime != self._stamp_mtime:
+                self._entries.clear()
+                self._generation += 1
+                self._stamp_mtime = mtime
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                return fragment
+            generation = self._generation
+        html = render()
+        fragment = Fragment(
+            Markup(html),
+            hashlib.sha1(html.encode('utf-8')).hexdigest(),
+            datetime.utcnow().replace(microsecond=0)
+        )
+        with self._lock:
+            if generation != self._generation:
+                return fragment
+            self._entries[key] = fragment
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            os.makedirs(os.path.dirname(self.stamp), exist_ok=True)
+            with open(self.stamp, 'a'):
+                os.utime(self.stamp, ns=(time.time_ns(), time.time_ns()))
+            self._stamp_mtime = self._read_stamp()
+
+
+course_fragments = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_STAMP'])
+
+
+@event.listens_for(Course, 'after_insert')
+@event.listens_for(Course, 'after_update')
+@event.listens_for(Course, 'after_delete')
+def _course_changed(mapper, connection, target):
+    object_session(target).info['courses_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_course_fragments(session):
+    # only once the change is visible to the requests that re-render
+    if session.info.pop('courses_changed', False):
+        course_fragments.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_course_changes(session):
+    session.info.pop('courses_changed', None)
+
+
+def render_cached_page(template, fragment, user, profilepic, **context):
+    """
+    Render `template` around a cached fragment for the logged in user.
+
+    The ETag covers the fragment and everything the user layouts show
+    (name, role, verification badge, avatar, and the full name and
+    location student.html puts on its map), so browsers revalidating an
+    unchanged page get a 304 without the page being rendered.
+    """
+    profile = getattr(user, user.role, None)
+    location = user.location
+    etag = hashlib.sha1('\0'.join([
+        template,
+        fragment.etag,
+        str(user.id),
+        user.username,
+        user.role,
+        str(bool(getattr(profile, 'account_verification_status', False))),
+        str(getattr(profile, 'full_name', None)),
+        str(location and location.latitude),
+        str(location and location.longitude),
+        profilepic,
+    ]).encode('utf-8')).hexdigest()
+    # pending flash messages are only shown by a full render
+    if '_flashes' not in session and \
+            not is_resource_modified(request.environ, etag=etag, last_modified=fragment.last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(render_template(
+            template, fragment=fragment.html, user=user, profilepic=profilepic, **context))
+    response.set_etag(etag)
+    response.last_modified = fragment.last_modified
+    # per-user pages: browsers may keep them but must revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,170 @@
+import re
+from collections import namedtuple
+
+from sqlalchemy import event, select, text
+
+from . import db
+from .models import (
+    User,
+    Tutor,
+    Course,
+    Mycourse,
+    Qualification,
+    Experience,
+    Achievement
+)
+from .queries import tutor_card
+from .search import page_size
+
+
+# One FTS5 document per tutor, keyed by rowid = user id. The column order
+# matters: BM25_WEIGHTS below lines up with it.
+FTS_TABLE = 'tutor_search'
+FTS_COLUMNS = (
+    'username',
+    'full_name',
+    'description',
+    'courses',
+    'qualifications',
+    'experiences',
+    'achievements',
+)
+BM25_WEIGHTS = (2.0, 3.0, 1.0, 2.0, 1.0, 1.0, 1.0)
+
+CREATE_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+    "{columns}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+).format(table=FTS_TABLE, columns=', '.join(FTS_COLUMNS))
+
+TextResult = namedtuple('TextResult', ['User', 'score'])
+
+_enabled = {}
+
+
+def is_enabled(connection):
+    """ Whether this database has the full-text table (SQLite only) """
+    url = str(connection.engine.url)
+    if url not in _enabled:
+        _enabled[url] = connection.dialect.name == 'sqlite' and bool(
+            connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                name=FTS_TABLE
+            ).first()
+        )
+    return _enabled[url]
+
+
+def _joined(connection, query):
+    return ' '.join(value for row in connection.execute(query) for value in row if value)
+
+
+def _document(connection, tutor_id):
+    profile = connection.execute(
+        select([User.username, Tutor.full_name, Tutor.description])
+        .select_from(User.__table__.join(Tutor.__table__))
+        .where(User.id == tutor_id)
+    ).first()
+    if profile is None:
+        return None
+    return {
+        'username': profile.username or '',
+        'full_name': profile.full_name or '',
+        'description': profile.description or '',
+        'courses': _joined(connection,
+            select([Course.course_title, Course.course_description])
+            .select_from(Mycourse.__table__.join(Course.__table__))
+            .where(Mycourse.user_id == tutor_id)),
+        'qualifications': _joined(connection,
+            select([Qualification.qualification]).where(Qualification.tutor_id == tutor_id)),
+        'experiences': _joined(connection,
+            select([Experience.title]).where(Experience.tutor_id == tutor_id)),
+        'achievements': _joined(connection,
+            select([Achievement.achievement]).where(Achievement.tutor_id == tutor_id)),
+    }
+
+
+def index_tutors(connection, tutor_ids):
+    """ Rewrite the documents of the given tutors, dropping removed tutors """
+    insert = text("INSERT INTO {0} (rowid, {1}) VALUES (:rowid, {2})".format(
+        FTS_TABLE, ', '.join(FTS_COLUMNS), ', '.join(':' + c for c in FTS_COLUMNS)))
+    for tutor_id in tutor_ids:
+        connection.execute(
+            text("DELETE FROM {0} WHERE rowid = :rowid".format(FTS_TABLE)), rowid=tutor_id)
+        document = _document(connection, tutor_id)
+        if document is not None:
+            connection.execute(insert, rowid=tutor_id, **document)
+
+
+def rebuild_index():
+    """ Create the full-text table if needed and re-index every tutor """
+    connection = db.session.connection()
+    connection.execute(text(CREATE_FTS_TABLE))
+    connection.execute(text("DELETE FROM {0}".format(FTS_TABLE)))
+    _enabled.pop(str(connection.engine.url), None)
+    tutor_ids = [row[0] for row in connection.execute(select([Tutor.user_id]))]
+    index_tutors(connection, tutor_ids)
+    db.session.commit()
+
+
+def _affected_tutors(session, connection):
+    tutor_ids, course_ids = set(), set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Tutor):
+            tutor_ids.add(obj.user_id)
+        elif isinstance(obj, User) and obj.role == 'tutor':
+            tutor_ids.add(obj.id)
+        elif isinstance(obj, Mycourse):
+            tutor_ids.add(obj.user_id)
+        elif isinstance(obj, (Qualification, Experience, Achievement)):
+            tutor_ids.add(obj.tutor_id)
+        elif isinstance(obj, Course):
+            course_ids.add(obj.id)
+    if course_ids:
+        tutor_ids.update(row[0] for row in connection.execute(
+            select([Mycourse.user_id]).where(Mycourse.course_id.in_(course_ids))))
+    tutor_ids.discard(None)
+    return tutor_ids
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_fulltext_index(session, flush_context):
+    connection = session.connection()
+    if not is_enabled(connection):
+        return
+    index_tutors(connection, _affected_tutors(session, connection))
+
+
+def match_expression(terms):
+    """ Turn free text into an FTS5 query of quoted prefix terms, all required """
+    words = re.findall(r'\w+', terms or '', re.UNICODE)
+    return ' '.join('"{0}"*'.format(word) for word in words)
+
+
+def search_tutors_text(terms, limit=None):
+    """
+    Return up to `limit` tutors matching `terms`, best match first, as
+    TextResult(User, score) pairs. Every word may be a prefix.
+    """
+    limit = page_size(limit)
+    expression = match_expression(terms)
+    if not expression:
+        return []
+    connection = db.session.connection()
+    if is_enabled(connection):
+        ranked = connection.execute(
+            text("SELECT rowid, bm25({0}, {1}) AS score FROM {0} "
+                 "WHERE {0} MATCH :expression ORDER BY score LIMIT :limit"
+                 .format(FTS_TABLE, ', '.join(map(str, BM25_WEIGHTS)))),
+            expression=expression, limit=limit
+        ).fetchall()
+        scores = {row.rowid: -row.score for row in ranked}
+        tutors = User.query.filter(User.id.in_(scores)).options(*tutor_card()).all()
+    else:
+        pattern = '%{0}%'.format(terms.strip())
+        tutors = User.query.join(Tutor).filter(
+            User.role == 'tutor',
+            db.or_(User.username.ilike(pattern), Tutor.full_name.ilike(pattern))
+        ).options(*tutor_card()).limit(limit).all()
+        scores = {tutor.id: 0 for tutor in tutors}
+    tutors.sort(key=lambda tutor: -scores[tutor.id])
+    return [TextResult(tutor, scores[tutor.id]) for tutor in tutors]
@@ -0,0 +1,128 @@
+from math import radians, degrees, sin, cos, asin, sqrt, floor
+
+from sqlalchemy import and_, event, or_
+
+from . import app, db
+from .models import User, Location
+from .queries import located_tutor_marker
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Locations are bucketed into fixed-size lat/lng grid cells. A cell id is
+# row * GRID_COLUMNS + column, so every row of cells inside a bounding box is
+# one contiguous range on the indexed `location.grid_cell` column.
+GRID_CELL_DEGREES = 0.05
+GRID_COLUMNS = int(360 / GRID_CELL_DEGREES)
+MAX_CELL_ROWS = 64
+
+app.config.setdefault('TUTOR_SEARCH_RADIUS_KM', 10)
+app.config.setdefault('TUTOR_SEARCH_LIMIT', 10)
+
+
+def _grid_row(lat):
+    return int(floor((lat + 90) / GRID_CELL_DEGREES))
+
+
+def _grid_column(lng):
+    return int(floor((lng + 180) / GRID_CELL_DEGREES)) % GRID_COLUMNS
+
+
+def grid_cell(lat, lng):
+    """ Return the grid cell id for a coordinate, or None if it is unset """
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    return _grid_row(lat) * GRID_COLUMNS + _grid_column(lng)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """ Great-circle distance between two coordinates in kilometres """
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+def bounding_box(lat, lng, radius_km):
+    """ Return (min_lat, min_lng, max_lat, max_lng) enclosing the radius """
+    lat_delta = degrees(radius_km / EARTH_RADIUS_KM)
+    lng_delta = degrees(radius_km / (EARTH_RADIUS_KM * max(cos(radians(lat)), 1e-6)))
+    return (
+        max(lat - lat_delta, -90.0),
+        lng - min(lng_delta, 180.0),
+        min(lat + lat_delta, 90.0),
+        lng + min(lng_delta, 180.0),
+    )
+
+
+def cell_ranges(min_lat, min_lng, max_lat, max_lng):
+    """ Yield inclusive (low, high) grid cell ranges covering a bounding box """
+    first_col, last_col = _grid_column(min_lng), _grid_column(max_lng)
+    wraps = max_lng - min_lng >= 360 or first_col > last_col
+    for row in range(_grid_row(min_lat), _grid_row(max_lat) + 1):
+        base = row * GRID_COLUMNS
+        if max_lng - min_lng >= 360:
+            yield base, base + GRID_COLUMNS - 1
+        elif wraps:
+            yield base + first_col, base + GRID_COLUMNS - 1
+            yield base, base + last_col
+        else:
+            yield base + first_col, base + last_col
+
+
+def box_filter(min_lat, min_lng, max_lat, max_lng):
+    """
+    Condition on Location for the grid cells covering the bounding box: a
+    superset of the box, to be narrowed by exact coordinates.
+
+    A box spanning more than MAX_CELL_ROWS rows of cells is read as one
+    index range from its first cell to its last, with the longitude
+    checked in the scan, rather than an OR of that many ranges.
+    """
+    ranges = list(cell_ranges(min_lat, min_lng, max_lat, max_lng))
+    if len(ranges) <= MAX_CELL_ROWS:
+        return or_(*[Location.grid_cell.between(low, high) for low, high in ranges])
+    span = Location.grid_cell.between(min(low for low, _ in ranges), max(high for _, high in ranges))
+    if -180 <= min_lng and max_lng <= 180:
+        return and_(span, Location.longitude.between(min_lng, max_lng))
+    return span
+
+
+def tutors_in_box(min_lat, min_lng, max_lat, max_lng):
+    """ Query for tutors with a location inside the bounding box """
+    return db.session.query(User, Location).join(Location).filter(
+        User.role == 'tutor', box_filter(min_lat, min_lng, max_lat, max_lng)).options(*located_tutor_marker())
+
+
+def nearest_tutors(lat, lng, radius_km=None, limit=None):
+    """
+    Return up to `limit` (tutor, distance_km) pairs within `radius_km` of the
+    given coordinate, closest first.
+
+    Candidates are fetched through the indexed grid cells covering the
+    bounding box of the radius, then filtered by exact distance.
+    """
+    if radius_km is None:
+        radius_km = app.config['TUTOR_SEARCH_RADIUS_KM']
+    if limit is None:
+        limit = app.config['TUTOR_SEARCH_LIMIT']
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return []
+    nearby = []
+    for tutor, location in tutors_in_box(*bounding_box(lat, lng, radius_km)):
+        if location.latitude is None or location.longitude is None:
+            continue
+        distance = haversine(lat, lng, location.latitude, location.longitude)
+        if distance <= radius_km:
+            nearby.append((tutor, distance))
+    nearby.sort(key=lambda pair: pair[1])
+    return nearby[:limit]
+
+
+@event.listens_for(Location, 'before_insert')
+@event.listens_for(Location, 'before_update')
+def update_grid_cell(mapper, connection, location):
+    location.grid_cell = grid_cell(location.latitude, location.longitude)
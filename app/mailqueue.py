@@ -0,0 +1,250 @@
+import time
+import smtplib
+from datetime import datetime, timedelta
+
+import click
+from flask_mail import Message
+
+from . import app, db, mail
+from .models import User, MailJob, Broadcast
+from .metrics import timed_send
+
+
+app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 50)
+app.config.setdefault('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+app.config.setdefault('MAIL_QUEUE_BACKOFF_SECONDS', 30)
+app.config.setdefault('MAIL_QUEUE_CLAIM_TIMEOUT', 600)
+app.config.setdefault('MAIL_QUEUE_INTERVAL', 10)
+app.config.setdefault('BROADCAST_CHUNK_SIZE', 100)
+app.config.setdefault('BROADCAST_MAX_PER_MINUTE', 600)
+
+
+def enqueue(msg):
+    """
+    Add a Flask-Mail message for the worker to the session and return the
+    job; it is queued when the caller commits, together with the change
+    the mail is about.
+    """
+    job = MailJob(
+        subject=msg.subject,
+        sender=msg.sender if isinstance(msg.sender, str) else '{0} <{1}>'.format(*msg.sender),
+        recipients=','.join(msg.recipients),
+        body=msg.body,
+        html=msg.html
+    )
+    db.session.add(job)
+    return job
+
+
+def to_message(job):
+    msg = Message(job.subject, sender=job.sender, recipients=job.recipients.split(','))
+    msg.body = job.body
+    msg.html = job.html
+    return msg
+
+
+def queue_depth():
+    return MailJob.query.filter(MailJob.status.in_(['pending', 'sending'])).count()
+
+
+def broadcasts_in_progress():
+    return Broadcast.query.filter(Broadcast.status.in_(['pending', 'sending'])).count()
+
+
+def claim_jobs(limit):
+    """
+    Atomically mark up to `limit` due jobs as sending and return them.
+
+    Jobs are claimed with a conditional UPDATE, so several workers (or the
+    scheduler running in every gunicorn worker) never send the same job.
+    Claims older than MAIL_QUEUE_CLAIM_TIMEOUT are assumed abandoned.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['MAIL_QUEUE_CLAIM_TIMEOUT'])
+    due = MailJob.query.filter(db.or_(
+        db.and_(MailJob.status == 'pending', MailJob.next_attempt_at <= now),
+        db.and_(MailJob.status == 'sending', MailJob.claimed_at < stale)
+    )).order_by(MailJob.next_attempt_at).limit(limit).with_entities(MailJob.id, MailJob.status).all()
+    claimed = []
+    for job_id, status in due:
+        updated = MailJob.query.filter_by(id=job_id, status=status) \
+            .update({'status': 'sending', 'claimed_at': now}, synchronize_session=False)
+        if updated:
+            claimed.append(job_id)
+    db.session.commit()
+    return MailJob.query.filter(MailJob.id.in_(claimed)).order_by(MailJob.id).all() if claimed else []
+
+
+def _failed(job, error):
+    job.attempts = (job.attempts or 0) + 1
+    job.last_error = str(error)[:255]
+    if job.attempts >= app.config['MAIL_QUEUE_MAX_ATTEMPTS']:
+        job.status = 'failed'
+    else:
+        delay = app.config['MAIL_QUEUE_BACKOFF_SECONDS'] * 2 ** (job.attempts - 1)
+        job.status = 'pending'
+        job.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def process_queue(limit=None):
+    """ Send one batch of due jobs over a single SMTP connection """
+    jobs = claim_jobs(limit or app.config['MAIL_QUEUE_BATCH_SIZE'])
+    if not jobs:
+        return 0
+    sent = 0
+    try:
+        with mail.connect() as connection:
+            for index, job in enumerate(jobs):
+                try:
+                    timed_send(connection, to_message(job), 'queue')
+                except smtplib.SMTPServerDisconnected:
+                    # the connection is gone, retry the rest with backoff
+                    for unsent in jobs[index:]:
+                        _failed(unsent, 'SMTP server disconnected')
+                    break
+                except Exception as e:
+                    _failed(job, e)
+                else:
+                    job.status = 'sent'
+                    job.attempts = (job.attempts or 0) + 1
+                    sent += 1
+                db.session.commit()
+    except (smtplib.SMTPException, OSError) as e:
+        for job in jobs:
+            if job.status == 'sending':
+                _failed(job, e)
+    db.session.commit()
+    return sent
+
+
+def queue_broadcast(title, message):
+    """ Add an announcement to every non-admin user to the session for the worker """
+    broadcast = Broadcast(
+        title=title,
+        message=message,
+        total=User.query.filter(User.role != 'admin').count()
+    )
+    db.session.add(broadcast)
+    return broadcast
+
+
+def claim_broadcast():
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['MAIL_QUEUE_CLAIM_TIMEOUT'])
+    due = Broadcast.query.filter(db.or_(
+        db.and_(Broadcast.status == 'pending', Broadcast.next_attempt_at <= now),
+        db.and_(Broadcast.status == 'sending', Broadcast.claimed_at < stale)
+    )).order_by(Broadcast.next_attempt_at, Broadcast.id).with_entities(Broadcast.id, Broadcast.status).first()
+    if due is None:
+        return None
+    updated = Broadcast.query.filter_by(id=due.id, status=due.status) \
+        .update({'status': 'sending', 'claimed_at': now}, synchronize_session=False)
+    db.session.commit()
+    return Broadcast.query.get(due.id) if updated else None
+
+
+def next_chunk(broadcast):
+    """
+    The next list of (user id, email) after the broadcast's checkpoint.
+
+    Each chunk is its own bounded keyset query rather than one long-lived
+    cursor, so the checkpoint is committed between chunks without holding
+    a read transaction open on the user table.
+    """
+    return User.query.filter(User.role != 'admin', User.id > (broadcast.last_user_id or 0)) \
+        .order_by(User.id).with_entities(User.id, User.email).limit(app.config['BROADCAST_CHUNK_SIZE']).all()
+
+
+def send_broadcast_chunk(broadcast):
+    """
+    Send the next chunk of a claimed broadcast and release it until the
+    next chunk is due under BROADCAST_MAX_PER_MINUTE. Progress is committed
+    per chunk, so an interrupted broadcast resumes after the last chunk
+    that went out; failures back off like mail jobs and give up after
+    MAIL_QUEUE_MAX_ATTEMPTS in a row.
+    """
+    now = datetime.utcnow()
+    broadcast.started_at = broadcast.started_at or now
+    chunk = next_chunk(broadcast)
+    if not chunk:
+        broadcast.status = 'sent'
+        broadcast.finished_at = now
+        db.session.commit()
+        return False
+    msg = Message(
+        f'[Find Your Tutor] {broadcast.title}',
+        sender=app.config.get('MAIL_SENDER'),
+        bcc=[email for user_id, email in chunk if email]
+    )
+    msg.body = broadcast.message
+    try:
+        if msg.bcc:
+            with mail.connect() as connection:
+                timed_send(connection, msg, 'broadcast')
+    except (smtplib.SMTPException, OSError) as e:
+        _failed(broadcast, e)
+        db.session.commit()
+        return False
+    pause = 60.0 * app.config['BROADCAST_CHUNK_SIZE'] / app.config['BROADCAST_MAX_PER_MINUTE']
+    broadcast.last_user_id = chunk[-1].id
+    broadcast.sent_count = (broadcast.sent_count or 0) + len(msg.bcc)
+    broadcast.attempts = 0
+    if len(chunk) < app.config['BROADCAST_CHUNK_SIZE']:
+        broadcast.status = 'sent'
+        broadcast.finished_at = datetime.utcnow()
+    else:
+        broadcast.status = 'pending'
+        broadcast.next_attempt_at = now + timedelta(seconds=pause)
+    db.session.commit()
+    return True
+
+
+def process_broadcasts():
+    """ Send at most one chunk of the most overdue broadcast """
+    broadcast = claim_broadcast()
+    if broadcast is None:
+        return False
+    return send_broadcast_chunk(broadcast)
+
+
+def drain():
+    """
+    Send everything that is due. Broadcast chunks go out one at a time
+    between batches of mail jobs, so a large broadcast never holds up
+    registration or password reset mail.
+    """
+    while True:
+        sent = process_queue()
+        chunk_sent = process_broadcasts()
+        if not sent and not chunk_sent:
+            return
+
+
+def run_scheduled():
+    with app.app_context():
+        drain()
+
+
+def start_scheduler():
+    """
+    Drain the queue from a background thread of this process. Only the
+    web entry point (wsgi.py) starts it, so CLI commands, the mail worker
+    and tests importing the app don't.
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(run_scheduled, 'interval', seconds=app.config['MAIL_QUEUE_INTERVAL'],
+        max_instances=1, coalesce=True)
+    scheduler.start()
+    return scheduler
+
+
+@app.cli.command('mail-worker')
+@click.option('--once', is_flag=True, help='Send what is due and exit.')
+def mail_worker(once):
+    """ Run the outbound mail worker """
+    while True:
+        drain()
+        if once:
+            break
+        time.sleep(app.config['MAIL_QUEUE_INTERVAL'])
@@ -0,0 +1,202 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from sqlalchemy import and_, event, or_, select
+
+from . import app, db
+from .models import User, Tutor, Location, Mycourse, Course, CourseMatch
+from .queries import joined_tutor
+from .ranking import haversine, rank_matches
+from .schedule import overlap_minutes, course_overlaps
+
+
+TutorMatches = namedtuple('TutorMatches', 'User Tutor matches')
+
+_student_course = Mycourse.__table__.alias('student_course')
+_tutor_course = Mycourse.__table__.alias('tutor_course')
+_student = User.__table__.alias('student_user')
+_tutor = User.__table__.alias('tutor_user')
+_student_location = Location.__table__.alias('student_location')
+_tutor_location = Location.__table__.alias('tutor_location')
+_match = CourseMatch.__table__
+
+
+def hour_offset(start, end, other_start, other_end):
+    """ The larger difference in hours between the two starts and the two ends """
+    if None in (start, end, other_start, other_end):
+        return None
+    return max(abs(start.hour - other_start.hour), abs(end.hour - other_end.hour))
+
+
+def _cost(value):
+    # costs of migrated rows may be stored as text
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def price_delta(cost, other_cost):
+    """ How much more `other_cost` is than `cost`, None if either is unset """
+    cost, other_cost = _cost(cost), _cost(other_cost)
+    if cost is None or other_cost is None:
+        return None
+    return other_cost - cost
+
+
+def _pairs(connection, user_ids=None):
+    """ Student course / tutor course pairs for the same course """
+    if user_ids is not None:
+        # one indexed lookup per side: an OR across both sides makes the
+        # planner scan every student
+        rows = {}
+        for side in (_student_course, _tutor_course):
+            for row in connection.execute(_pairs_query().where(side.c.user_id.in_(user_ids))):
+                rows[row[0], row[1]] = row
+        return list(rows.values())
+    return connection.execute(_pairs_query())
+
+
+def _pairs_query():
+    return select([
+        _student_course.c.id, _tutor_course.c.id,
+        _student.c.id, _tutor.c.id, _student_course.c.course_id,
+        _student_course.c.cost, _tutor_course.c.cost,
+        _student_course.c.time, _student_course.c.endtime,
+        _tutor_course.c.time, _tutor_course.c.endtime,
+        _student_location.c.latitude, _student_location.c.longitude,
+        _tutor_location.c.latitude, _tutor_location.c.longitude,
+    ]).select_from(
+        _student_course
+        .join(_student, and_(_student.c.id == _student_course.c.user_id, _student.c.role == 'student'))
+        .join(_tutor_course, _tutor_course.c.course_id == _student_course.c.course_id)
+        .join(_tutor, and_(_tutor.c.id == _tutor_course.c.user_id, _tutor.c.role == 'tutor'))
+        .outerjoin(_student_location, _student_location.c.user_id == _student.c.id)
+        .outerjoin(_tutor_location, _tutor_location.c.user_id == _tutor.c.id)
+    )
+
+
+def _coordinates(pairs, index):
+    """ One coordinate column of the pairs as a contiguous array, NaN where unset """
+    return np.fromiter((np.nan if pair[index] is None else pair[index] for pair in pairs),
+        dtype=np.float64, count=len(pairs))
+
+
+def _distances(pairs):
+    """ Student-tutor distance of every pair in one vectorized pass, None where unknown """
+    # student lat, student lng, tutor lat, tutor lng
+    distances = haversine(*(_coordinates(pairs, index) for index in range(11, 15)))
+    values = distances.tolist()
+    for index in np.flatnonzero(np.isnan(distances)):
+        values[index] = None
+    return values
+
+
+def _match_rows(pairs, overlaps=None):
+    pairs = list(pairs)
+    return [_match_row(pair, distance, overlaps) for pair, distance in zip(pairs, _distances(pairs))]
+
+
+def _match_row(pair, distance, overlaps=None):
+    (student_course_id, tutor_course_id, student_id, tutor_id, course_id,
+        student_cost, tutor_cost, start, end, tutor_start, tutor_end) = pair[:11]
+    if overlaps is None or None in (start, end, tutor_start, tutor_end):
+        overlap = overlap_minutes(start, end, tutor_start, tutor_end)
+    else:
+        overlap = overlaps.get((student_course_id, tutor_course_id), 0)
+    return {
+        'student_id': student_id,
+        'tutor_id': tutor_id,
+        'course_id': course_id,
+        'student_course_id': student_course_id,
+        'tutor_course_id': tutor_course_id,
+        'distance_km': distance,
+        'price_delta': price_delta(student_cost, tutor_cost),
+        'overlap_minutes': overlap,
+        'hour_offset': hour_offset(start, end, tutor_start, tutor_end),
+    }
+
+
+def refresh_matches(connection, user_ids):
+    """ Recompute every match a student or tutor in `user_ids` takes part in """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    connection.execute(_match.delete().where(or_(
+        _match.c.student_id.in_(user_ids), _match.c.tutor_id.in_(user_ids))))
+    rows = _match_rows(_pairs(connection, user_ids))
+    if rows:
+        connection.execute(_match.insert(), rows)
+
+
+def rebuild_matches():
+    """ Recompute the whole course_match table, returns the number of rows """
+    connection = db.session.connection()
+    connection.execute(_match.delete())
+    # schedule overlaps of every course in one sweep each, not pair by pair
+    overlaps = course_overlaps()
+    rows = _match_rows(_pairs(connection), overlaps)
+    if rows:
+        connection.execute(_match.insert(), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def _affected_users(session):
+    user_ids = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, (Mycourse, Location)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, User) and (obj in session.deleted or db.inspect(obj).attrs.role.history.has_changes()):
+            user_ids.add(obj.id)
+    user_ids.discard(None)
+    return user_ids
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_course_matches(session, flush_context):
+    user_ids = _affected_users(session)
+    if user_ids:
+        refresh_matches(session.connection(), user_ids)
+
+
+def student_matches(student_id):
+    """
+    The student's matches grouped by tutor, best ranked tutor first.
+
+    One indexed read of course_match joined to the tutor's profile and
+    course; rows within a tutor are ordered by cost.
+    """
+    rows = db.session.query(CourseMatch, User, Tutor, Mycourse, Course) \
+        .join(User, User.id == CourseMatch.tutor_id) \
+        .join(Tutor, User.tutor) \
+        .join(Mycourse, Mycourse.id == CourseMatch.tutor_course_id) \
+        .join(Course, Course.id == CourseMatch.course_id) \
+        .filter(CourseMatch.student_id == student_id) \
+        .options(*joined_tutor()) \
+        .order_by(Mycourse.cost, CourseMatch.student_course_id) \
+        .all()
+    tutors = OrderedDict()
+    for row in rows:
+        if row.User.id not in tutors:
+            tutors[row.User.id] = TutorMatches(row.User, row.Tutor, [])
+        tutors[row.User.id].matches.append(row)
+    ranking = rank_matches([
+        (
+            tutor.User.id,
+            min((row.CourseMatch.distance_km for row in tutor.matches
+                if row.CourseMatch.distance_km is not None), default=None),
+            min((_cost(row.Mycourse.cost) for row in tutor.matches
+                if _cost(row.Mycourse.cost) is not None), default=None),
+            tutor.Tutor.account_verification_status,
+            tutor.User.follower_count,
+        )
+        for tutor in tutors.values()
+    ])
+    return [tutors[user_id] for user_id in ranking]
+
+
+@app.cli.command('rebuild-course-matches')
+def rebuild_course_matches_command():
+    """ Recompute the student-tutor course_match table """
+    print('Stored {0} matches.'.format(rebuild_matches()))
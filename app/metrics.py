@@ -0,0 +1,292 @@
+import os
+import json
+import glob
+import time
+import atexit
+import bisect
+import secrets
+import threading
+
+from flask import g, request, template_rendered, before_render_template
+
+from . import app
+
+
+app.config.setdefault('METRICS_BUCKETS', (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+app.config.setdefault('METRICS_QUANTILES', (0.5, 0.95, 0.99))
+app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+
+METRICS = {
+    'fyt_http_request_duration_seconds': ('histogram', 'Request latency by endpoint.'),
+    'fyt_http_requests_total': ('counter', 'Requests by endpoint, method and status code.'),
+    'fyt_db_queries_total': ('counter', 'SQL statements executed, by endpoint.'),
+    'fyt_db_seconds_total': ('counter', 'Time spent in SQL statements, by endpoint.'),
+    'fyt_template_renders_total': ('counter', 'Templates rendered, by template.'),
+    'fyt_template_render_seconds_total': ('counter', 'Time spent rendering templates, by template.'),
+    'fyt_mail_sends_total': ('counter', 'SMTP sends by kind and result.'),
+    'fyt_mail_send_seconds_total': ('counter', 'Time spent in SMTP sends, by kind.'),
+}
+
+
+class Registry:
+    """
+    Counters and histograms of this process.
+
+    With a directory, the totals are written to <directory>/<pid>_<id>.json
+    at most every METRICS_FLUSH_INTERVAL seconds, and `collect` adds up the
+    files of every running process (gunicorn workers, the mail worker) that
+    shares the directory. A process removes its file when it exits; files
+    left by processes that were killed are skipped and removed by `collect`.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self._pid = os.getpid()
+        self._path = self.directory and os.path.join(
+            self.directory, '{0}_{1}.json'.format(self._pid, secrets.token_hex(4)))
+        self._flushed_at = time.monotonic()
+
+    def _check_fork(self):
+        # a forked worker must not write its totals over the parent's file
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self._maybe_flush()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = app.config['METRICS_BUCKETS']
+        with self._lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+        self._maybe_flush()
+
+    def state(self):
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(h[0]), h[1], h[2]] for (name, labels), h in self.histograms.items()],
+            }
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() - self._flushed_at >= app.config['METRICS_FLUSH_INTERVAL']:
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        self._flushed_at = time.monotonic()
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state(), f)
+        os.replace(temp_path, self._path)
+
+    def close(self):
+        """ Remove this process's file """
+        if self.directory and os.getpid() == self._pid:
+            _remove(self._path)
+            _remove(self._path + '.tmp')
+
+    def collect(self):
+        """ Merged counters and histograms of every running process """
+        states = [self.state()]
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == self._path:
+                    continue
+                pid = _file_pid(path)
+                if pid is None:
+                    continue
+                # left behind by a worker that was killed
+                if not _running(pid):
+                    _remove(path)
+                    continue
+                try:
+                    with open(path) as f:
+                        states.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        counters, histograms = {}, {}
+        for state in states:
+            for name, labels, value in state['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, total, count in state['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _file_pid(path):
+    try:
+        return int(os.path.basename(path).split('_', 1)[0])
+    except ValueError:
+        return None
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+registry = Registry(app.config.get('METRICS_DIR'))
+if registry.directory:
+    os.makedirs(registry.directory, exist_ok=True)
+    atexit.register(registry.close)
+
+
+def quantile(q, bounds, buckets):
+    """ Estimate a quantile from bucket counts, as histogram_quantile() does """
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(buckets):
+        if seen + count >= rank and count:
+            if index == len(bounds):
+                return bounds[-1]
+            lower = bounds[index - 1] if index else 0.0
+            return lower + (bounds[index] - lower) * (rank - seen) / count
+        seen += count
+    return bounds[-1]
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render(gauges=None):
+    """ Prometheus text exposition of every process's metrics plus `gauges` """
+    counters, histograms = registry.collect()
+    bounds = app.config['METRICS_BUCKETS']
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{0}{1} {2}'.format(name, _labels(labels), value))
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(list(bounds) + ['+Inf'], buckets):
+                cumulative += bucket
+                lines.append('{0}_bucket{1} {2}'.format(name, _labels(labels, le=bound), cumulative))
+            lines.append('{0}_sum{1} {2}'.format(name, _labels(labels), total))
+            lines.append('{0}_count{1} {2}'.format(name, _labels(labels), count))
+
+    # precomputed p50/p95/p99 for readers without a Prometheus server
+    name = 'fyt_http_request_latency_seconds'
+    lines.append('# HELP {0} Estimated request latency quantiles by endpoint.'.format(name))
+    lines.append('# TYPE {0} gauge'.format(name))
+    for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+        if metric == 'fyt_http_request_duration_seconds':
+            for q in app.config['METRICS_QUANTILES']:
+                value = quantile(q, bounds, buckets)
+                if value is not None:
+                    lines.append('{0}{1} {2}'.format(name, _labels(labels, quantile=q), value))
+
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} gauge'.format(name))
+        lines.append('{0} {1}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+@app.before_request
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or '(unmatched)'
+    registry.observe('fyt_http_request_duration_seconds',
+        {'endpoint': endpoint}, time.perf_counter() - started)
+    registry.inc('fyt_http_requests_total',
+        {'endpoint': endpoint, 'method': request.method, 'status': response.status_code})
+    # statements collected by the SQL profiler for this request
+    queries = g.get('sql_queries')
+    if queries:
+        registry.inc('fyt_db_queries_total', {'endpoint': endpoint}, len(queries))
+        registry.inc('fyt_db_seconds_total', {'endpoint': endpoint}, sum(d for _, d in queries))
+    return response
+
+
+_rendering = threading.local()
+
+
+def _before_render(sender, template, context, **extra):
+    _rendering.__dict__.setdefault('started', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    started = getattr(_rendering, 'started', None)
+    if not started:
+        return
+    labels = {'template': template.name}
+    registry.inc('fyt_template_renders_total', labels)
+    registry.inc('fyt_template_render_seconds_total', labels, time.perf_counter() - started.pop())
+
+
+before_render_template.connect(_before_render, app)
+template_rendered.connect(_rendered, app)
+
+
+def timed_send(connection, msg, kind):
+    """ Send `msg` over a Flask-Mail connection, recording time and result """
+    started = time.perf_counter()
+    try:
+        connection.send(msg)
+    except Exception:
+        registry.inc('fyt_mail_sends_total', {'kind': kind, 'result': 'failed'})
+        raise
+    else:
+        registry.inc('fyt_mail_sends_total', {'kind': kind, 'result': 'sent'})
+    finally:
+        registry.inc('fyt_mail_send_seconds_total', {'kind': kind}, time.perf_counter() - started)
@@ -1,7 +1,7 @@
 import os.path as op
+from datetime import datetime
 
 from flask import abort, Markup, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, current_user
 from flask_admin.menu import MenuLink
 from itsdangerous import URLSafeTimedSerializer as Serializer
@@ -9,12 +9,15 @@ from flask_admin.contrib.fileadmin import FileAdmin
 
 from . import db, login_manager
 from . import app, Admin, ModelView, AdminIndexView
+from .passwords import hash_password, verify_password, needs_rehash
 
 
 followers = db.Table(
     'followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id')),
+    db.Index('ix_followers_follower_id_followed_id', 'follower_id', 'followed_id', unique=True),
+    db.Index('ix_followers_followed_id', 'followed_id')
 )
 
 class User(UserMixin, db.Model):
@@ -24,6 +27,8 @@ class User(UserMixin, db.Model):
     hash_password = db.Column(db.String(120))
     role = db.Column(db.String(7), index=True)
     confirmed_account = db.Column(db.Boolean, default=False)
+    follower_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    following_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     student = db.relationship('Student', backref='base', uselist=False, cascade="all, delete")
     tutor = db.relationship('Tutor', backref='base', uselist=False, cascade="all, delete")
     location = db.relationship('Location', backref='User', uselist=False, cascade="all, delete")
@@ -39,10 +44,17 @@ class User(UserMixin, db.Model):
         return '<Email {}>'.format(self.email)
 
     def set_password(self, password):
-        self.hash_password = generate_password_hash(password)
+        self.hash_password = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.hash_password, password)
+        return verify_password(self.hash_password, password)
+
+    def rehash_password(self, password):
+        """ Re-hash a just verified password stored with old parameters """
+        if needs_rehash(self.hash_password):
+            self.set_password(password)
+            return True
+        return False
 
     def set_location(self):
         self.location = Location(User=self)
@@ -74,14 +86,36 @@ class User(UserMixin, db.Model):
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            self.following_count = User.following_count + 1
+            user.follower_count = User.follower_count + 1
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            self.following_count = User.following_count - 1
+            user.follower_count = User.follower_count - 1
 
     def is_following(self, user):
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        return db.session.query(followers.c.follower_id).filter(
+            followers.c.follower_id == self.id,
+            followers.c.followed_id == user.id).first() is not None
+
+    @staticmethod
+    def reconcile_follow_counts():
+        """ Repair drifted follower/following counters, returns rows fixed """
+        follower_total = db.select([db.func.count()]).where(
+            followers.c.followed_id == User.id).as_scalar()
+        following_total = db.select([db.func.count()]).where(
+            followers.c.follower_id == User.id).as_scalar()
+        fixed = User.query.filter(db.or_(
+            User.follower_count != follower_total,
+            User.following_count != following_total
+        )).update({
+            User.follower_count: follower_total,
+            User.following_count: following_total
+        }, synchronize_session=False)
+        db.session.commit()
+        return fixed
 
 
     def get_reset_token(self,expires_sec=1800):
@@ -145,9 +179,13 @@ class Tutor(db.Model):
     profile_pic = db.Column(db.String(255))
     description = db.Column(db.String(250))
     account_verification_status = db.Column(db.Boolean, default=False)
+    # cheapest offering, kept by app.search; 0 without courses
+    min_cost = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     experience = db.relationship('Experience', backref='Tutor', uselist=True ,cascade="all, delete")
     qualification = db.relationship('Qualification', backref='Tutor', uselist=True ,cascade="all, delete")
     achievement = db.relationship('Achievement', backref='Tutor', uselist=True ,cascade="all, delete")
+    # tutor search order: verified first, then cheapest
+    __table_args__ = (db.Index('ix_tutor_search_order', 'account_verification_status', 'min_cost', 'user_id'),)
 
     def __repr__(self):
         tutor = User.query.filter_by(id = self.user_id ).first()
@@ -156,7 +194,7 @@ class Tutor(db.Model):
 
 class Experience(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    tutor_id = db.Column(db.Integer, db.ForeignKey('tutor.user_id'))
+    tutor_id = db.Column(db.Integer, db.ForeignKey('tutor.user_id'), index=True)
     title = db.Column(db.String(255))
     institution = db.Column(db.String(255))
     experience = db.Column(db.String(255))
@@ -165,7 +203,7 @@ class Experience(db.Model):
 
 class Qualification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    tutor_id = db.Column(db.Integer, db.ForeignKey('tutor.user_id'))
+    tutor_id = db.Column(db.Integer, db.ForeignKey('tutor.user_id'), index=True)
     qualification = db.Column(db.String(255))
     institution = db.Column(db.String(255))
     qualification_date = db.Column(db.String(6))
@@ -174,7 +212,7 @@ class Qualification(db.Model):
 
 class Achievement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    tutor_id = db.Column(db.Integer, db.ForeignKey('tutor.user_id'))
+    tutor_id = db.Column(db.Integer, db.ForeignKey('tutor.user_id'), index=True)
     achievement = db.Column(db.String(255))
     awarded_by = db.Column(db.String(255))
     awarded_date = db.Column(db.String(255))
@@ -185,26 +223,124 @@ class Location(db.Model):
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
     place_details = db.Column(db.String(255))
+    grid_cell = db.Column(db.Integer, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
 
 
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     course_title = db.Column(db.String(100), nullable=False)
-    course_level = db.Column(db.String(100), nullable=False)
+    course_level = db.Column(db.String(100), nullable=False, index=True)
     course_description = db.Column(db.String(1000))
     mycourse = db.relationship('Mycourse', backref='Course', cascade="all, delete")
 
 
 class Mycourse(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'))
     time = db.Column(db.Time)
     endtime = db.Column(db.Time)
     cost = db.Column(db.Integer)
+    # tutors of a course, cheapest first
+    __table_args__ = (db.Index('ix_mycourse_course_id_cost', 'course_id', 'cost'),)
+
+
+
+class CourseMatch(db.Model):
+    """
+    A student's course paired with a tutor teaching the same course,
+    maintained by app.matching. Derived data, so no foreign keys: rows are
+    rebuilt whenever either side changes.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, nullable=False, index=True)
+    tutor_id = db.Column(db.Integer, nullable=False, index=True)
+    course_id = db.Column(db.Integer, nullable=False)
+    student_course_id = db.Column(db.Integer, nullable=False)
+    tutor_course_id = db.Column(db.Integer, nullable=False)
+    distance_km = db.Column(db.Float)
+    price_delta = db.Column(db.Integer)
+    overlap_minutes = db.Column(db.Integer)
+    hour_offset = db.Column(db.Integer)
+    __table_args__ = (db.UniqueConstraint('student_course_id', 'tutor_course_id'),)
+
+
+class TutorSimilarity(db.Model):
+    """
+    A tutor's nearest neighbours by shared followers, written by the
+    offline job in app.recommend.
+    """
+    tutor_id = db.Column(db.Integer, primary_key=True)
+    similar_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+class TutorRecommendation(db.Model):
+    """ Top recommended tutors per user, maintained by app.recommend """
+    user_id = db.Column(db.Integer, primary_key=True)
+    tutor_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+class DocumentBlob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    directory = db.Column(db.String(32), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    __table_args__ = (db.UniqueConstraint('directory', 'name'),)
 
 
+class MailJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    sender = db.Column(db.String(255))
+    recipients = db.Column(db.Text)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(7), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Broadcast(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(255))
+    message = db.Column(db.Text)
+    status = db.Column(db.String(7), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_user_id = db.Column(db.Integer, default=0)
+    sent_count = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer)
+    last_error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    claimed_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def progress(self):
+        if not self.total:
+            return 100.0 if self.status == 'sent' else 0.0
+        return min(100.0, 100.0 * (self.sent_count or 0) / self.total)
+
+    def throughput(self):
+        """ Recipients per minute since the broadcast started """
+        if not self.started_at:
+            return 0.0
+        until = self.finished_at or datetime.utcnow()
+        minutes = max((until - self.started_at).total_seconds() / 60, 1 / 60)
+        return (self.sent_count or 0) / minutes
+
+
+@app.cli.command('reconcile-follow-counts')
+def reconcile_follow_counts_command():
+    """ Recount followers and following for every user """
+    print('Fixed {0} users.'.format(User.reconcile_follow_counts()))
+
 
 @login_manager.user_loader
 def load_user(id):
@@ -263,6 +399,7 @@ class StudentView(CannotDeleteView):
 
 class TutorView(StudentView):
     can_edit = True
+    column_exclude_list = ['min_cost']
     form_edit_rules = ['account_verification_status']
 
 
@@ -314,6 +451,16 @@ class CourseView(ModelView):
     form_edit_rules = ('course_title', 'course_level', 'course_description')
 
 
+class BroadcastView(CannotDeleteView):
+    can_edit = False
+    column_list = ['title', 'status', 'sent_count', 'total', 'progress', 'throughput', 'last_error', 'created_at', 'finished_at']
+    column_default_sort = ('created_at', True)
+    column_formatters = {
+        'progress': lambda view, context, model, name: '{0:.1f}%'.format(model.progress()),
+        'throughput': lambda view, context, model, name: '{0:.0f}/min'.format(model.throughput())
+    }
+
+
 class LoggedInMenuLink(MenuLink):
     def is_accessible(self):
         return current_user.is_authenticated
@@ -332,6 +479,8 @@ admin.add_view(ShowLinkView(Experience, db.session))
 admin.add_view(ShowLinkView(Achievement, db.session))
 admin.add_view(ShowLinkView(Qualification, db.session))
 
+admin.add_view(BroadcastView(Broadcast, db.session, name='Announcements'))
+
 path = op.join(op.dirname(__file__), 'static/docs/')
 admin.add_view(FileAdmin(path, '/static/docs/', name='Documents'))
 
@@ -0,0 +1,118 @@
+import hashlib
+import hmac
+import secrets
+
+from werkzeug.security import check_password_hash
+
+from . import app
+from .ratelimit import TokenBucketLimiter
+
+
+app.config.setdefault('PASSWORD_CHECK_RATE', 1.0)
+app.config.setdefault('PASSWORD_CHECK_BURST', 5)
+
+SALT_BYTES = 16
+# bytes of derived key in new hashes; verifying uses the length stored
+KEY_BYTES = 32
+
+
+class Pbkdf2Hasher:
+    """
+    PBKDF2-HMAC-SHA256, stored as pbkdf2:sha256:<iterations>$<salt>$<hash>,
+    the format werkzeug writes.
+    """
+
+    name = 'pbkdf2'
+
+    def __init__(self, iterations):
+        self.iterations = iterations
+
+    @property
+    def method(self):
+        return 'pbkdf2:sha256:{0}'.format(self.iterations)
+
+    @staticmethod
+    def derive(method, salt, password, length=KEY_BYTES):
+        _, digest, iterations = method.split(':')
+        return hashlib.pbkdf2_hmac(
+            digest, password.encode('utf-8'), salt.encode('utf-8'), int(iterations), dklen=length).hex()
+
+
+def _scrypt_memory(n, r, p):
+    # OpenSSL needs 128 * r * (n + 2) bytes for V plus 128 * r * p for B
+    return 128 * r * (n + p + 2) + 1024
+
+
+class ScryptHasher:
+    """ scrypt, stored as scrypt:<n>:<r>:<p>$<salt>$<hash> """
+
+    name = 'scrypt'
+
+    def __init__(self, n, r, p):
+        # what OpenSSL accepts, so a bad setting gets a clear error
+        if n < 2 or n & (n - 1) or n >= 2 ** (16 * r) or r < 1 or p < 1:
+            raise ValueError('Invalid scrypt parameters N={0}, r={1}, p={2}'.format(n, r, p))
+        self.n, self.r, self.p = n, r, p
+
+    @property
+    def method(self):
+        return 'scrypt:{0}:{1}:{2}'.format(self.n, self.r, self.p)
+
+    @staticmethod
+    def derive(method, salt, password, length=KEY_BYTES):
+        _, n, r, p = method.split(':')
+        n, r, p = int(n), int(r), int(p)
+        return hashlib.scrypt(
+            password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+            maxmem=_scrypt_memory(n, r, p), dklen=length
+        ).hex()
+
+
+HASHERS = {'pbkdf2': Pbkdf2Hasher, 'scrypt': ScryptHasher}
+
+
+def configured_hasher():
+    """ The hasher new passwords are stored with, from the app config """
+    name = app.config['PASSWORD_HASHER']
+    if name == 'pbkdf2':
+        return Pbkdf2Hasher(app.config['PASSWORD_PBKDF2_ITERATIONS'])
+    if name == 'scrypt':
+        return ScryptHasher(app.config['PASSWORD_SCRYPT_N'], app.config['PASSWORD_SCRYPT_R'],
+            app.config['PASSWORD_SCRYPT_P'])
+    raise ValueError('Unknown PASSWORD_HASHER {0!r}'.format(name))
+
+
+def hash_password(password):
+    hasher = configured_hasher()
+    salt = secrets.token_hex(SALT_BYTES)
+    return '{0}${1}${2}'.format(hasher.method, salt, hasher.derive(hasher.method, salt, password))
+
+
+def verify_password(stored, password):
+    """
+    Check `password` against any stored hash, including ones werkzeug
+    wrote. A malformed hash fails the check rather than raising.
+    """
+    if not stored or stored.count('$') != 2:
+        return False
+    method, salt, expected = stored.split('$')
+    hasher = HASHERS.get(method.split(':', 1)[0])
+    if hasher is None or (hasher is Pbkdf2Hasher and method.count(':') != 2):
+        # werkzeug's other formats, e.g. a salted plain digest
+        return check_password_hash(stored, password)
+    try:
+        # werkzeug's scrypt hashes keep a 64 byte key, ours 32
+        derived = hasher.derive(method, salt, password, len(expected) // 2)
+        return hmac.compare_digest(derived, expected)
+    except (ValueError, TypeError, OverflowError):
+        app.logger.warning('Unreadable %s password hash', method)
+        return False
+
+
+def needs_rehash(stored):
+    """ Whether a stored hash was made with other than the configured parameters """
+    return not stored or stored.split('$', 1)[0] != configured_hasher().method
+
+
+# the as-you-type check on the delete account form costs a full verify
+password_checks = TokenBucketLimiter(app.config['PASSWORD_CHECK_RATE'], app.config['PASSWORD_CHECK_BURST'])
@@ -0,0 +1,243 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import url_for
+from markupsafe import Markup
+from PIL import Image, ImageOps
+
+from . import app
+from .models import Student, Tutor
+from .uploads import UploadRejected, spool_upload
+
+
+app.config.setdefault('PROFILE_PIC_CACHE_TTL', 5)
+app.config.setdefault('PROFILE_PIC_WORKERS', 2)
+
+# Pillow refuses to decode anything past twice this many pixels
+Image.MAX_IMAGE_PIXELS = app.config['PROFILE_PIC_MAX_PIXELS']
+
+# Every upload is stored as <content hash>_<size>.<format> for each size, in
+# WebP plus a JPEG fallback. The database keeps the DEFAULT_SIZE JPEG name.
+PICTURE_SIZES = (48, 96, 200, 400)
+DEFAULT_SIZE = 200
+PICTURE_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+VARIANT_NAME = re.compile(r'^(?P<base>[0-9a-f]{16})_(?P<size>\d+)\.(?P<ext>jpg|webp)$')
+
+
+class PictureDirectory:
+    """
+    In-memory index of the files in a directory.
+
+    Lookups are answered from a set of names. Uploads and deletes in this
+    process update the set directly; changes made by other workers are picked
+    up by re-reading the directory when its mtime changes, checked at most
+    once every `ttl` seconds.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._names = None
+        self._missing = set()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with os.scandir(self.path) as entries:
+            self._names = {entry.name for entry in entries if entry.is_file()}
+        self._missing = set()
+
+    def _revalidate(self):
+        now = time.monotonic()
+        if self._names is not None and now - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if self._names is None or mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+            self._checked_at = now
+
+    def __contains__(self, name):
+        if not name:
+            return False
+        self._revalidate()
+        if name in self._names:
+            return True
+        if name in self._missing:
+            return False
+        # not seen yet, it may have just been written by another worker
+        if os.path.isfile(os.path.join(self.path, name)):
+            self._names.add(name)
+            return True
+        self._missing.add(name)
+        return False
+
+    def add(self, name):
+        self._revalidate()
+        self._names.add(name)
+        self._missing.discard(name)
+
+    def discard(self, name):
+        self._revalidate()
+        self._names.discard(name)
+        self._missing.add(name)
+
+
+profile_pics = PictureDirectory(
+    os.path.join(app.root_path, 'static', 'profile_pics'),
+    app.config['PROFILE_PIC_CACHE_TTL']
+)
+
+
+_pool = ThreadPoolExecutor(
+    max_workers=app.config['PROFILE_PIC_WORKERS'], thread_name_prefix='profile-pics')
+
+
+def variant_name(name, size, ext):
+    """ Name of another size/format of a pipeline picture, None for legacy files """
+    match = VARIANT_NAME.match(name or '')
+    if not match:
+        return None
+    return '{0}_{1}.{2}'.format(match.group('base'), size, ext)
+
+
+def _variants(base):
+    return [
+        '{0}_{1}.{2}'.format(base, size, ext)
+        for size in sorted(PICTURE_SIZES, key=lambda size: size != DEFAULT_SIZE)
+        for ext, _, _ in PICTURE_FORMATS
+    ]
+
+
+def _render_variants(temp_path, base):
+    try:
+        with Image.open(temp_path) as upload:
+            # let JPEGs decode at a reduced scale, no larger than needed
+            upload.draft('RGB', (max(PICTURE_SIZES), max(PICTURE_SIZES)))
+            # bake the EXIF orientation into the pixels; the re-encoded files
+            # carry no EXIF (location, camera) at all
+            image = ImageOps.exif_transpose(upload).convert('RGB')
+        for size in sorted(PICTURE_SIZES, key=lambda size: size != DEFAULT_SIZE):
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            for ext, pil_format, options in PICTURE_FORMATS:
+                name = '{0}_{1}.{2}'.format(base, size, ext)
+                path = os.path.join(profile_pics.path, name)
+                temp_variant = path + '.tmp'
+                resized.save(temp_variant, pil_format, **options)
+                os.replace(temp_variant, path)
+                profile_pics.add(name)
+    except Exception:
+        app.logger.exception('Could not process profile picture %s', base)
+    finally:
+        os.remove(temp_path)
+
+
+def _check_image(temp_path):
+    """ Read only the image header and enforce PROFILE_PIC_MAX_PIXELS """
+    try:
+        with Image.open(temp_path) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise UploadRejected('Picture has too many pixels.')
+    except (OSError, SyntaxError):
+        raise UploadRejected('Picture could not be read.')
+    if width * height > app.config['PROFILE_PIC_MAX_PIXELS']:
+        raise UploadRejected('Picture has too many pixels.')
+
+
+def save_profile_picture(upload):
+    """
+    Store an uploaded picture and return the name to keep in the database.
+
+    The upload is streamed to disk and checked against PROFILE_PIC_MAX_BYTES
+    and PROFILE_PIC_MAX_PIXELS, raising UploadRejected. The variants are
+    rendered on a worker pool; until the default one is written the user
+    keeps seeing the placeholder picture.
+    """
+    temp_path, digest = spool_upload(
+        upload, profile_pics.path, app.config['PROFILE_PIC_MAX_BYTES'])
+    base = digest[:16]
+    try:
+        _check_image(temp_path)
+    except UploadRejected:
+        os.remove(temp_path)
+        raise
+    if all(name in profile_pics for name in _variants(base)):
+        os.remove(temp_path)
+    else:
+        _pool.submit(_render_variants, temp_path, base)
+    return '{0}_{1}.jpg'.format(base, DEFAULT_SIZE)
+
+
+def delete_profile_picture(name):
+    """ Remove a picture's files unless another profile still uses them """
+    references = Student.query.filter_by(profile_pic=name).count() + \
+        Tutor.query.filter_by(profile_pic=name).count()
+    if references > 1:
+        return
+    match = VARIANT_NAME.match(name)
+    names = _variants(match.group('base')) if match else [name]
+    for name in names:
+        profile_pics.discard(name)
+        try:
+            os.remove(os.path.join(profile_pics.path, name))
+        except FileNotFoundError:
+            pass
+
+
+def fetch_default_profile_pic(user_obj):
+    if isinstance(user_obj, Tutor):
+        return url_for('static', filename='profile_pics/tutor.jpg')
+    else:
+        return url_for('static', filename='profile_pics/student.jpg')
+
+
+@app.template_global()
+def fetch_profile_pic(user_obj, size=DEFAULT_SIZE):
+    """ URL of the JPEG of a profile picture, which every browser can show """
+    pic_name_from_db = getattr(user_obj, 'profile_pic', None)
+    for name in (variant_name(pic_name_from_db, size, 'jpg'), pic_name_from_db):
+        if name and name in profile_pics:
+            return url_for('static', filename='profile_pics/' + name)
+    return fetch_default_profile_pic(user_obj)
+
+
+def _srcset(name, ext):
+    variants = ((size, variant_name(name, size, ext)) for size in PICTURE_SIZES)
+    return ', '.join(
+        '{0} {1}w'.format(url_for('static', filename='profile_pics/' + variant), size)
+        for size, variant in variants if variant in profile_pics
+    )
+
+
+@app.template_global()
+def profile_picture(user_obj, sizes, **attributes):
+    """
+    A <picture> of a profile picture for an <img> `sizes` wide. Every stored
+    size is offered in WebP and JPEG, so the browser picks a format it
+    supports and the smallest file that is sharp at that width; the URL
+    does not depend on request headers, so caches need no Vary.
+    """
+    pic_name_from_db = getattr(user_obj, 'profile_pic', None)
+    sources = Markup('')
+    if variant_name(pic_name_from_db, DEFAULT_SIZE, 'jpg') in profile_pics:
+        for ext, mimetype in (('webp', 'image/webp'), ('jpg', 'image/jpeg')):
+            srcset = _srcset(pic_name_from_db, ext)
+            if srcset:
+                sources += Markup('<source type="{0}" srcset="{1}" sizes="{2}">').format(mimetype, srcset, sizes)
+    img = Markup('<img src="{0}"').format(fetch_profile_pic(user_obj))
+    for key, value in attributes.items():
+        img += Markup(' {0}="{1}"').format(key, value)
+    return Markup('<picture>{0}{1}></picture>').format(sources, img)
@@ -0,0 +1,149 @@
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import app
+
+
+app.config.setdefault('SQL_PROFILER_ENABLED', True)
+app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+app.config.setdefault('SQL_PROFILER_TOP', 10)
+app.config.setdefault('SQL_PROFILER_MAX_STATEMENTS', 200)
+
+BACKGROUND = '(background)'
+
+# IN lists of different lengths are the same statement
+_IN_LIST = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)')
+
+
+class EndpointStats:
+    """ Query count, DB time and per-statement totals for one endpoint """
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = {}
+
+    def add(self, statement, duration):
+        self.queries += 1
+        self.db_time += duration
+        stats = self.statements.get(statement)
+        if stats is None:
+            if len(self.statements) >= app.config['SQL_PROFILER_MAX_STATEMENTS']:
+                return
+            stats = self.statements[statement] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+
+    def to_dict(self, top):
+        statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'queries_per_request': self.queries / self.requests if self.requests else None,
+            'db_time_ms': self.db_time * 1000,
+            'db_time_per_request_ms': self.db_time * 1000 / self.requests if self.requests else None,
+            'top_statements': [
+                {
+                    'statement': statement,
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'max_ms': longest * 1000,
+                }
+                for statement, (count, total, longest) in statements[:top]
+            ],
+        }
+
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def _endpoint_stats(endpoint):
+    stats = _stats.get(endpoint)
+    if stats is None:
+        stats = _stats.setdefault(endpoint, EndpointStats())
+    return stats
+
+
+def normalize(statement):
+    return _IN_LIST.sub('(?...)', ' '.join(statement.split()))
+
+
+def snapshot():
+    """ Aggregates of this worker process since start or the last reset """
+    top = app.config['SQL_PROFILER_TOP']
+    with _lock:
+        return {endpoint: stats.to_dict(top) for endpoint, stats in sorted(_stats.items())}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def explain(conn, statement, parameters):
+    """ The database's query plan for `statement`, as text """
+    if conn.dialect.name == 'sqlite':
+        prefix, column = 'EXPLAIN QUERY PLAN ', -1
+    else:
+        prefix, column = 'EXPLAIN ', 0
+    # a raw DB-API cursor, so the EXPLAIN is not profiled itself
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(str(row[column]) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    if not app.config['SQL_PROFILER_ENABLED']:
+        return
+
+    if has_request_context():
+        g.setdefault('sql_queries', []).append((statement, duration))
+    else:
+        with _lock:
+            _endpoint_stats(BACKGROUND).add(normalize(statement), duration)
+
+    if duration * 1000 >= app.config['SQL_SLOW_QUERY_MS']:
+        plan = None
+        if not executemany and statement.split(None, 1)[0].upper() in ('SELECT', 'WITH'):
+            try:
+                plan = explain(conn, statement, parameters)
+            except Exception as e:
+                plan = 'EXPLAIN failed: {0}'.format(e)
+        # parameters are left out: they hold password hashes, emails and tokens
+        app.logger.warning(
+            'Slow query (%.1f ms) in %s: %s\n%s',
+            duration * 1000,
+            request.endpoint if has_request_context() else BACKGROUND,
+            statement, plan or ''
+        )
+
+
+@app.teardown_request
+def _record_request(exc):
+    queries = g.pop('sql_queries', None)
+    if not app.config['SQL_PROFILER_ENABLED']:
+        return
+    endpoint = request.endpoint or '(unmatched)'
+    with _lock:
+        stats = _endpoint_stats(endpoint)
+        stats.requests += 1
+        for statement, duration in queries or ():
+            stats.add(normalize(statement), duration)
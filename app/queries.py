@@ -0,0 +1,27 @@
+from sqlalchemy.orm import joinedload, contains_eager
+
+from .models import User
+
+
+# Reusable loader options for pages that list users. Each profile loads the
+# relationships the matching templates touch in the same SELECT, so listing
+# N users costs a constant number of queries instead of 1 + N lazy loads.
+
+def tutor_card():
+    """ Tutor profile for search results and followed-tutor cards """
+    return (joinedload(User.tutor),)
+
+
+def located_tutor_marker():
+    """ Tutor profile and location, for queries that already join Location """
+    return (joinedload(User.tutor), contains_eager(User.location))
+
+
+def student_card():
+    """ Student profile for follower cards """
+    return (joinedload(User.student),)
+
+
+def joined_tutor():
+    """ For (User, Tutor, ...) row queries that already join Tutor """
+    return (contains_eager(User.tutor),)
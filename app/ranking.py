@@ -0,0 +1,90 @@
+import numpy as np
+
+from . import app
+from .geo import EARTH_RADIUS_KM
+
+
+app.config.setdefault('TUTOR_RANKING_WEIGHTS', {
+    'distance': 0.4,
+    'cost': 0.3,
+    'verification': 0.2,
+    'followers': 0.1,
+})
+
+
+class Candidates:
+    """ Candidate tutors held column-wise in contiguous NumPy arrays """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.user_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        self.distances = np.array([_float(r[1]) for r in rows], dtype=np.float64)
+        self.costs = np.array([_float(r[2]) for r in rows], dtype=np.float64)
+        self.verified = np.fromiter((bool(r[3]) for r in rows), dtype=np.bool_, count=len(rows))
+        self.follower_counts = np.fromiter((r[4] or 0 for r in rows), dtype=np.float64, count=len(rows))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def haversine(lat, lng, latitudes, longitudes):
+    """
+    Vectorized great-circle distance in kilometres between coordinates held
+    in contiguous arrays, element by element; either side may also be one
+    coordinate. A missing (NaN) coordinate gives a NaN distance.
+    """
+    lat, lng = np.radians(lat), np.radians(lng)
+    latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((latitudes - lat) / 2) ** 2 + \
+        np.cos(lat) * np.cos(latitudes) * np.sin((longitudes - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _normalize(values):
+    """ Scale to [0, 1]; missing values get the worst score of 1 """
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.ones_like(values)
+    low, high = values[finite].min(), values[finite].max()
+    spread = high - low
+    scaled = (values - low) / spread if spread else np.zeros_like(values)
+    return np.where(finite, scaled, 1.0)
+
+
+def score(candidates, weights=None):
+    """
+    Combined score per candidate, higher is better. Near, cheap, verified and
+    popular tutors score highest.
+    """
+    weights = weights or app.config['TUTOR_RANKING_WEIGHTS']
+    popularity = np.log1p(candidates.follower_counts)
+    return (
+        weights['distance'] * (1 - _normalize(candidates.distances))
+        + weights['cost'] * (1 - _normalize(candidates.costs))
+        + weights['verification'] * candidates.verified
+        + weights['followers'] * _normalize(popularity)
+    )
+
+
+def rank(candidates, weights=None):
+    """ Return candidate user ids ordered from best to worst match """
+    if not len(candidates):
+        return []
+    scores = score(candidates, weights)
+    order = np.argsort(-scores, kind='stable')
+    return candidates.user_ids[order].tolist()
+
+
+def rank_matches(tutors):
+    """
+    Rank precomputed matches given as (user id, distance km, cost, verified,
+    follower count) tuples.
+    """
+    return rank(Candidates(tutors))
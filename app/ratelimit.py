@@ -0,0 +1,52 @@
+import math
+import threading
+import time
+
+from flask import jsonify
+
+
+class TokenBucketLimiter:
+    """
+    A token bucket per key: each holds at most `burst` tokens and refills
+    at `rate` tokens a second; a request spends one.
+
+    Buckets live in this process, so with several workers each enforces
+    its own limit. At most `max_keys` buckets are kept; full ones, which
+    carry no state, are dropped first.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """ Spend a token for `key`: (allowed, seconds until the next token) """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._store(key, tokens - 1, now)
+                return True, 0.0
+            self._store(key, tokens, now)
+            return False, (1 - tokens) / self.rate
+
+    def _store(self, key, tokens, now):
+        if key not in self._buckets and len(self._buckets) >= self.max_keys:
+            for old_key, (old_tokens, updated) in list(self._buckets.items()):
+                if old_tokens + (now - updated) * self.rate >= self.burst:
+                    del self._buckets[old_key]
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.clear()
+        self._buckets[key] = (tokens, now)
+
+
+def too_many_requests(retry_after, message='Too many requests, try again shortly.'):
+    """ A JSON 429 response telling the client when to retry """
+    response = jsonify({'message': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
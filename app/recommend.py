@@ -0,0 +1,192 @@
+import heapq
+
+import numpy as np
+from sqlalchemy import and_, event, select
+
+from . import app, db
+from .models import User, TutorSimilarity, TutorRecommendation, followers
+from .queries import tutor_card
+
+
+app.config.setdefault('RECOMMENDATION_NEIGHBOURS', 50)
+app.config.setdefault('RECOMMENDATIONS_PER_USER', 10)
+
+_similarity = TutorSimilarity.__table__
+_recommendation = TutorRecommendation.__table__
+_tutor = User.__table__.alias('tutor_user')
+
+
+class FollowMatrix:
+    """
+    The follower graph as a sparse user x tutor matrix of implicit feedback,
+    in CSR arrays (`indptr`, `indices`) plus the transposed CSC arrays for
+    walking a tutor's followers. Every stored entry is a 1.
+    """
+
+    def __init__(self, pairs):
+        pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+        self.user_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+        self.tutor_ids, columns = np.unique(pairs[:, 1], return_inverse=True)
+        self.indptr, self.indices = _compress(rows, columns, len(self.user_ids))
+        self.tutor_indptr, self.tutor_indices = _compress(columns, rows, len(self.tutor_ids))
+
+    def followed(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def followers(self, column):
+        return self.tutor_indices[self.tutor_indptr[column]:self.tutor_indptr[column + 1]]
+
+    def follower_counts(self):
+        return np.diff(self.tutor_indptr)
+
+
+def _compress(rows, columns, size):
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, columns[order]
+
+
+def similar_tutors(matrix, neighbours):
+    """
+    Yield (tutor id, similar tutor id, cosine similarity) for each tutor's
+    `neighbours` most similar tutors, two tutors being similar when the
+    same users follow both.
+    """
+    size = len(matrix.tutor_ids)
+    norms = np.sqrt(matrix.follower_counts())
+    for column in range(size):
+        users = matrix.followers(column)
+        # one row of the item-item co-occurrence matrix, X^T X
+        shared = np.bincount(
+            np.concatenate([matrix.followed(row) for row in users]), minlength=size
+        ).astype(np.float64)
+        shared[column] = 0
+        candidates = np.flatnonzero(shared)
+        scores = shared[candidates] / (norms[column] * norms[candidates])
+        if len(candidates) > neighbours:
+            top = np.argpartition(-scores, neighbours - 1)[:neighbours]
+            candidates, scores = candidates[top], scores[top]
+        for candidate, score in zip(candidates, scores):
+            yield int(matrix.tutor_ids[column]), int(matrix.tutor_ids[candidate]), float(score)
+
+
+def recommend(user_id, followed, neighbours, limit):
+    """
+    The `limit` best (tutor id, score) pairs for a user following `followed`:
+    each tutor scores the sum of its similarities to the followed tutors.
+    `neighbours` maps a tutor id to its (similar id, score) pairs.
+    """
+    followed = set(followed)
+    scores = {}
+    for tutor_id in followed:
+        for similar_id, score in neighbours.get(tutor_id, ()):
+            if similar_id not in followed and similar_id != user_id:
+                scores[similar_id] = scores.get(similar_id, 0.0) + score
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _follow_pairs(connection, user_ids=None):
+    """ (user id, tutor id) for every follow of a tutor """
+    query = select([followers.c.follower_id, followers.c.followed_id]).select_from(
+        followers.join(_tutor, and_(_tutor.c.id == followers.c.followed_id, _tutor.c.role == 'tutor')))
+    if user_ids is not None:
+        query = query.where(followers.c.follower_id.in_(user_ids))
+    return connection.execute(query).fetchall()
+
+
+def _recommendation_rows(user_id, followed, neighbours):
+    return [
+        {'user_id': user_id, 'tutor_id': tutor_id, 'score': score}
+        for tutor_id, score in recommend(user_id, followed, neighbours, app.config['RECOMMENDATIONS_PER_USER'])
+    ]
+
+
+def build_recommendations():
+    """
+    Offline job: recompute tutor similarities from the whole follower graph
+    and every user's recommendations. Returns (similarities, recommendations).
+    """
+    connection = db.session.connection()
+    matrix = FollowMatrix(_follow_pairs(connection))
+    similarities = [
+        {'tutor_id': tutor_id, 'similar_id': similar_id, 'score': score}
+        for tutor_id, similar_id, score in similar_tutors(matrix, app.config['RECOMMENDATION_NEIGHBOURS'])
+    ]
+    neighbours = {}
+    for row in similarities:
+        neighbours.setdefault(row['tutor_id'], []).append((row['similar_id'], row['score']))
+    recommendations = []
+    for row, user_id in enumerate(matrix.user_ids):
+        followed = matrix.tutor_ids[matrix.followed(row)].tolist()
+        recommendations.extend(_recommendation_rows(int(user_id), followed, neighbours))
+
+    connection.execute(_similarity.delete())
+    connection.execute(_recommendation.delete())
+    if similarities:
+        connection.execute(_similarity.insert(), similarities)
+    if recommendations:
+        connection.execute(_recommendation.insert(), recommendations)
+    db.session.commit()
+    return len(similarities), len(recommendations)
+
+
+def refresh_recommendations(connection, user_ids):
+    """
+    Recompute the recommendations of `user_ids` from the stored tutor
+    similarities, which only the offline job rebuilds.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    followed = {user_id: [] for user_id in user_ids}
+    for user_id, tutor_id in _follow_pairs(connection, user_ids):
+        followed[user_id].append(tutor_id)
+    tutor_ids = {tutor_id for tutors in followed.values() for tutor_id in tutors}
+    neighbours = {}
+    if tutor_ids:
+        for tutor_id, similar_id, score in connection.execute(
+                select([_similarity.c.tutor_id, _similarity.c.similar_id, _similarity.c.score])
+                .where(_similarity.c.tutor_id.in_(tutor_ids))):
+            neighbours.setdefault(tutor_id, []).append((similar_id, score))
+
+    connection.execute(_recommendation.delete().where(_recommendation.c.user_id.in_(user_ids)))
+    rows = [row for user_id in user_ids for row in _recommendation_rows(user_id, followed[user_id], neighbours)]
+    if rows:
+        connection.execute(_recommendation.insert(), rows)
+
+
+def _follows_changed(session):
+    user_ids = set()
+    for obj in session.dirty:
+        if isinstance(obj, User) and db.inspect(obj).attrs.followed.history.has_changes():
+            user_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+    user_ids.discard(None)
+    return user_ids
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_recommendations(session, flush_context):
+    user_ids = _follows_changed(session)
+    if user_ids:
+        refresh_recommendations(session.connection(), user_ids)
+
+
+def recommended_tutors(user_id, limit=None):
+    """ The user's stored recommendations, best first: an indexed lookup """
+    query = User.query.join(TutorRecommendation, TutorRecommendation.tutor_id == User.id) \
+        .filter(TutorRecommendation.user_id == user_id, User.role == 'tutor') \
+        .order_by(TutorRecommendation.score.desc(), User.id) \
+        .options(*tutor_card())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+@app.cli.command('build-recommendations')
+def build_recommendations_command():
+    """ Recompute tutor similarities and recommendations from the follower graph """
+    print('Stored {0} similarities and {1} recommendations.'.format(*build_recommendations()))
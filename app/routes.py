@@ -17,10 +17,9 @@ from flask_login import (
     current_user,
 )
 
-import os
-import secrets
-from PIL import Image
+from flask_wtf.csrf import generate_csrf
 from werkzeug.urls import url_parse
+from werkzeug.http import is_resource_modified
 
 from . import app, db
 from . import login_manager
@@ -37,7 +36,8 @@ from .forms import (
     MyCourseForm,
     MyExperienceForm,
     MyAchievementForm,
-    MyQualificationForm
+    MyQualificationForm,
+    SqlProfileResetForm
 )
 from .models import (
     User, 
@@ -51,6 +51,33 @@ from .models import (
     Mycourse,
     AdminAccountActivitiesView
 )
+from .tiles import tile_cache, render_tile, valid_tile
+from .geo import nearest_tutors
+from .matching import student_matches
+from .schedule import schedule_matches
+from .recommend import recommended_tutors
+from .passwords import password_checks
+from .availability import taken_names, availability_checks
+from .ratelimit import too_many_requests
+from .queries import tutor_card, student_card
+from .search import (
+    parse_filters,
+    find_tutors,
+    serialize_result,
+    InvalidCursor
+)
+from .fulltext import search_tutors_text
+from .pictures import (
+    save_profile_picture,
+    delete_profile_picture
+)
+from .docstore import save_document, delete_document
+from .uploads import UploadRejected
+from .context import profile_context
+from .fragments import course_fragments, render_cached_page
+from .profiler import snapshot as sql_profile, reset as reset_sql_profile
+from .metrics import render as render_metrics
+from .mailqueue import queue_depth, broadcasts_in_progress
 
 
 def redirect_user(user):
@@ -101,10 +128,9 @@ def send_admin_announcements():
         msg_title = request.form.get('title', '')
         msg_body = request.form.get('message', '')
         if msg_title and msg_body:
-            non_admin_users = User.query.filter(User.role != "admin").all()
-            email_list = list(map(lambda x: x.email, non_admin_users))
-            # em.send_announcements_mail(msg_title, msg_body, email_list)
-            flash('Successfully sent mail!', 'success')
+            em.send_announcements_mail(msg_title, msg_body)
+            db.session.commit()
+            flash('Announcement queued! Track its progress under Announcements.', 'success')
         else:
             flash('Could not send empty mail!', 'danger')
         return redirect('/admin')    
@@ -118,7 +144,7 @@ def admin_account_activities():
     if current_user.is_authenticated and not current_user.role=='admin':
         return redirect_user(current_user)
     form = AccountInfoForm()
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if form.validate_on_submit():
         if not user.check_password(form.old_password.data):
             flash("Wrong password!","danger")
@@ -129,8 +155,40 @@ def admin_account_activities():
             flash("Successfully changed password!", "success")
             return redirect(url_for('admin_account_activities'))
     return AdminAccountActivitiesView().render('admin/admin-account-activities.html', form=form)
+
+
+@app.route('/admin/sql-profile', methods=['GET', 'POST'])
+@login_required
+def admin_sql_profile():
+    """
+    SQL profiler aggregates per endpoint for this worker. A POST resets
+    them; it needs the csrf_token a GET returns in its X-CSRFToken header.
+    """
+    if current_user.is_authenticated and current_user.role == 'admin':
+        if request.method == 'POST':
+            if not SqlProfileResetForm().validate_on_submit():
+                abort(400)
+            reset_sql_profile()
+        response = jsonify(sql_profile())
+        response.headers['X-CSRFToken'] = generate_csrf()
+        return response
+    else:
+        abort(401)
     
 
+@app.route('/metrics')
+def metrics():
+    """ Prometheus text-format metrics of every worker """
+    token = app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        abort(403)
+    body = render_metrics({
+        'fyt_mail_queue_depth': ('Mail jobs pending or being sent.', queue_depth()),
+        'fyt_broadcasts_in_progress': ('Announcements pending or being sent.', broadcasts_in_progress()),
+    })
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -149,6 +207,8 @@ def login():
             )
             return redirect(url_for('login'))
         login_user(user)
+        if user.rehash_password(form.password.data):
+            db.session.commit()
         flash('Successfully logged in.', 'success')
         next_page = request.args.get('next', '')
         if not next_page or url_parse(next_page).netloc != '':
@@ -161,10 +221,12 @@ def login():
 def check_username_availability(username):
     if current_user.is_authenticated:
         return redirect_user(current_user)
-    user = User.query.filter_by(username=username).first()
+    allowed, retry_after = availability_checks.acquire(request.remote_addr)
+    if not allowed:
+        return too_many_requests(retry_after)
     if "@" in username:
         return jsonify({"message": "You cannot include '@' in your username", "availability": False})
-    if user:
+    if taken_names.is_taken('username', username):
         return jsonify({"message": "Username not available", "availability": False})
     else:
         return jsonify({"message": "Username available for registration", "availability": True})
@@ -174,10 +236,12 @@ def check_username_availability(username):
 def check_email_availability(email):
     if current_user.is_authenticated:
         return redirect_user(current_user)
-    user = User.query.filter_by(email=email).first()
+    allowed, retry_after = availability_checks.acquire(request.remote_addr)
+    if not allowed:
+        return too_many_requests(retry_after)
     if not "@" in email:
         return jsonify({"message": "Email should contain an @", "availability": False})
-    if user:
+    if taken_names.is_taken('email', email):
         return jsonify({"message": "Email already registered", "availability": False})
     else:
         return jsonify({"message": "Email available for registration", "availability": True})
@@ -186,6 +250,9 @@ def check_email_availability(email):
 @app.route('/check/password/current-user/<password>')
 @login_required
 def check_user_password(password):
+    allowed, retry_after = password_checks.acquire(current_user.id)
+    if not allowed:
+        return too_many_requests(retry_after, 'Too many password checks, try again shortly.')
     return jsonify(current_user.check_password(password))
     
 
@@ -205,8 +272,10 @@ def user_register():
             user.set_student()
             user.update_student(phone=form.phone.data)
         user.set_location()
-        db.session.commit()
+        # the confirmation token needs the user's id
+        db.session.flush()
         em.send_registration_mail(user)
+        db.session.commit()
         flash('Your account was created. Mail has been sent to your email for confirmation.', 'success')
         return redirect(url_for('login'))        
     return render_template('register.html', form=form)
@@ -237,6 +306,7 @@ def reset_request():
             flash('Sorry, no user with that email registered!', 'danger')
             return redirect(url_for('reset_request'))
         em.send_reset_mail(user)
+        db.session.commit()
         flash('An email has been sent with instruction to reset your password','info')
         return redirect(url_for('login'))
 
@@ -288,52 +358,19 @@ def delete_user_account(username):
 
 
 def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    f_name, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, 'static/profile_pics/', picture_fn)
-    output_size = (200,200)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-    return picture_fn
+    return save_profile_picture(form_picture)
 
 def save_docs(docs, directory):
-    random_hex = secrets.token_hex(8)
-    f_name, f_ext = os.path.splitext(docs.filename)
-    docs_fn = random_hex + f_ext
-    docs_path = os.path.join(app.root_path, 'static/docs/' ,directory, docs_fn)
-    docs.save(docs_path)
-    return docs_fn
+    return save_document(docs, directory)
 
 
 def delete_picture(user_picture):
-    picture_path = os.path.join(app.root_path, 'static','profile_pics', user_picture)
-    os.remove(picture_path)
+    delete_profile_picture(user_picture)
 
 def delete_docs(docs,directory):
-    docs_path = os.path.join(app.root_path,'static','docs', directory, docs)
-    os.remove(docs_path)
+    delete_document(docs, directory)
 
 
-def fetch_default_profile_pic(user_obj):
-    if isinstance(user_obj, Tutor):
-        return url_for('static', filename='profile_pics/tutor.jpg')
-    else:
-        return url_for('static', filename='profile_pics/student.jpg')
-
-
-def fetch_profile_pic(user_obj):
-    try:
-        pic_name_from_db = getattr(user_obj, 'profile_pic')
-        picture_path = os.path.join(app.root_path, 'static/profile_pics')
-        if pic_name_from_db in os.listdir(picture_path):
-            profile_pic = url_for('static',filename='profile_pics/' + pic_name_from_db)
-            return profile_pic
-        return fetch_default_profile_pic(user_obj)
-    except:
-        return fetch_default_profile_pic(user_obj)
-
 @app.route('/follow/<username>')
 @login_required
 def follow(username):
@@ -387,13 +424,9 @@ def profile(username):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
     google_api = app.config.get('GOOGLE_MAP_API_KEY')
-    user = User.query.filter_by(username=current_user.username).first()
-    if is_tutor(user):
-        user_obj = Tutor.query.filter_by(user_id=user.id).first()
-    else:
-        user_obj = Student.query.filter_by(user_id=user.id).first()
+    user = profile_context().user
     view_user = User.query.filter_by(username=username).first_or_404()
-    return render_template('public-profile.html', user=user, view_user=view_user, profilepic= fetch_profile_pic(user_obj), google_api_key=google_api)
+    return render_template('public-profile.html', user=user, view_user=view_user, profilepic=profile_context().avatar, google_api_key=google_api)
 
 
 # Student Routes
@@ -405,15 +438,15 @@ def student():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
     google_api = app.config.get('GOOGLE_MAP_API_KEY')
-    tutor_list = User.query.filter_by(role="tutor")
-    user = User.query.filter_by(username=current_user.username).first()
-    mycourse = db.session.query(Course.id).select_from(User).join(Mycourse).join(Course).filter(User.id==current_user.id).subquery()
-    student_courses = db.session.query(User,Student,Mycourse,Course).select_from(User).join(Student).join(Mycourse).join(Course).filter(User.id==current_user.id).all()
-    matching_tutor = db.session.query(User,Tutor,Mycourse,Course).select_from(User).join(Tutor).join(Mycourse).join(Course).filter(Course.id.in_(mycourse)).order_by(Mycourse.cost).all()
-    distinct_matching_tutor = db.session.query(User,Tutor).select_from(User).join(Tutor).join(Mycourse).join(Course).filter(Course.id.in_(mycourse)).order_by(Tutor.account_verification_status.desc()).distinct()
+    user = profile_context().user
+    matching_tutor = student_matches(user.id)
+    schedule_tutor = schedule_matches(user.id, app.config['SCHEDULE_MATCH_LIMIT'])
+    nearby_tutors = []
+    if user.location:
+        nearby_tutors = nearest_tutors(user.location.latitude, user.location.longitude)
     if user.username == current_user.username and user.role == 'student':
-        student = Student.query.filter_by(user_id=user.id).first()
-        return render_template('student.html', user=user, student=student, tutor_list=tutor_list, profilepic= fetch_profile_pic(student), google_api_key=google_api, matching_tutor=matching_tutor, distinct_matching_tutor=distinct_matching_tutor,student_courses=student_courses)
+        student = profile_context().profile
+        return render_template('student.html', user=user, student=student, profilepic=profile_context().avatar, google_api_key=google_api, matching_tutor=matching_tutor, schedule_tutor=schedule_tutor, nearby_tutors=nearby_tutors)
     abort(404)
 
 
@@ -425,7 +458,7 @@ def student_location():
     form = MyLocationForm()
     google_api = app.config.get('GOOGLE_MAP_API_KEY')
     opencage_api = app.config.get('OPENCAGE_GEOCODE_API_KEY')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if form.validate_on_submit():
         user.update_location(
             latitude=form.latitude.data,
@@ -435,8 +468,8 @@ def student_location():
     location = Location.query.filter_by(user_id=user.id).first()
     
     if user.username == current_user.username and not is_tutor(user):
-        student=Student.query.filter_by(user_id=user.id).first()
-        return render_template("my-location.html", user=user, student=student, profilepic= fetch_profile_pic(student), form=form, google_api_key=google_api,
+        student = profile_context().profile
+        return render_template("my-location.html", user=user, student=student, profilepic=profile_context().avatar, form=form, google_api_key=google_api,
             opencage_api_key=opencage_api, location=location)
     elif user.username == current_user.username and is_tutor(user):
         return redirect(url_for('tutor_location'))
@@ -450,16 +483,17 @@ def student_personal_info():
     if is_tutor(current_user):
         return redirect(url_for('tutor_personal_info'))
     else:
-        user = User.query.filter_by(username=current_user.username).first()
-        student=Student.query.filter_by(user_id=user.id).first()
+        user = profile_context().user
+        student = profile_context().profile
         form = StudentPersonalInfoForm()
         form.create_state_choices()
         form.create_district_choices()
         if form.validate_on_submit():
             if form.profile_pic.data:
-                if student.profile_pic:
+                profile_pic = save_picture(form.profile_pic.data)
+                if student.profile_pic and student.profile_pic != profile_pic:
                     delete_picture(student.profile_pic)
-                current_user.update_student(profile_pic = save_picture(form.profile_pic.data))
+                current_user.update_student(profile_pic = profile_pic)
             current_user.update_student(
                 full_name=form.name.data, 
                 state=form.state.data,
@@ -473,7 +507,7 @@ def student_personal_info():
                 guardian_address=form.guardian_address.data,
                 guardian_phone=form.guardian_phone.data         
             )
-        return render_template("personal-info.html", user=user, user_obj=student, profilepic= fetch_profile_pic(student), form=form)
+        return render_template("personal-info.html", user=user, user_obj=student, profilepic=profile_context().avatar, form=form)
 
 
 @app.route('/student/account-activities', methods=['POST','GET'])
@@ -482,9 +516,9 @@ def student_account_activities():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
     form = AccountInfoForm()
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if user.username == current_user.username and not is_tutor(user):
-        student = Student.query.filter_by(user_id=user.id).first()
+        student = profile_context().profile
         if form.validate_on_submit():
             if not user.check_password(form.old_password.data):
                 flash("Wrong password!","danger")
@@ -494,7 +528,7 @@ def student_account_activities():
                 db.session.commit()
                 flash("Successfully changed password!", "success")
                 return redirect(url_for('student'))
-        return render_template("account-activities.html", user=user, student=student, profilepic= fetch_profile_pic(student), form=form)
+        return render_template("account-activities.html", user=user, student=student, profilepic=profile_context().avatar, form=form)
     elif user.username == current_user.username and is_tutor(user):
         return redirect(url_for('tutor_account_info'))
 
@@ -504,14 +538,14 @@ def student_account_activities():
 def student_courses():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     my_courses = Mycourse.query.filter_by(user_id=current_user.id)
     form = MyCourseForm()
     form.create_cost_choices()
     if user.username == current_user.username and not is_tutor(user):
-        student = Student.query.filter_by(user_id=user.id).first()
+        student = profile_context().profile
         return render_template("my-courses.html", user=user, student=student, 
-        profilepic= fetch_profile_pic(student), my_courses=my_courses, form=form)
+        profilepic=profile_context().avatar, my_courses=my_courses, form=form)
     elif user.username == current_user.username and is_tutor(user):
         return redirect(url_for('tutor'))
 
@@ -520,7 +554,7 @@ def student_courses():
 def delete_student_courses(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if user.username == current_user.username and not is_tutor(user):
         mycourse_to_be_deleted = Mycourse.query.filter_by(id=id).first_or_404()
         db.session.delete(mycourse_to_be_deleted)
@@ -535,29 +569,74 @@ def delete_student_courses(id):
 def search_tutors():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    username = request.args.get('username', '').lower()
-    tutor_list = User.query.filter_by(role="tutor").all()
-    if username:
-        tutor_list = User.query.filter_by(username=username).filter_by(role='tutor').all()
-    user = User.query.filter_by(username=current_user.username).first()
+    filters = parse_filters(request.args)
+    terms = request.args.get('q', '').strip()
+    if terms:
+        tutor_list, next_cursor = search_tutors_text(terms, request.args.get('per_page')), None
+    else:
+        try:
+            tutor_list, next_cursor = find_tutors(
+                filters, request.args.get('cursor'), request.args.get('per_page'))
+        except InvalidCursor:
+            abort(400)
+    user = profile_context().user
     if user.username == current_user.username and not is_tutor(user):
-        student = Student.query.filter_by(user_id=user.id).first()
-        return render_template('search-tutors.html', profilepic= fetch_profile_pic(student), 
-        user=user, tutors=tutor_list)
+        student = profile_context().profile
+        next_args = {key: value for key, value in request.args.items() if key != 'cursor'}
+        return render_template('search-tutors.html', profilepic=profile_context().avatar, 
+        user=user, tutors=tutor_list, next_cursor=next_cursor, next_args=next_args,
+        filters=filters, terms=terms, course_levels=Course.query.with_entities(Course.course_level).distinct())
     elif user.username == current_user.username and is_tutor(user):
         return redirect(url_for('tutor_followers'))
 
 
+@app.route('/api/tutors/search')
+@login_required
+def search_tutors_api():
+    terms = request.args.get('q', '').strip()
+    if terms:
+        results = search_tutors_text(terms, request.args.get('per_page'))
+        return jsonify({"results": [{
+            "username": result.User.username,
+            "full_name": result.User.tutor.full_name,
+            "verified": bool(result.User.tutor.account_verification_status),
+            "score": result.score
+        } for result in results], "next": None})
+    try:
+        results, next_cursor = find_tutors(
+            parse_filters(request.args), request.args.get('cursor'), request.args.get('per_page'))
+    except InvalidCursor:
+        return jsonify({"message": "Invalid cursor"}), 400
+    return jsonify({"results": [serialize_result(row) for row in results], "next": next_cursor})
+
+
+@app.route('/api/tutors/tiles/<int:z>/<int:x>/<int:y>')
+@login_required
+def tutor_tile(z, x, y):
+    if not valid_tile(z, x, y):
+        return jsonify({"message": "No such tile"}), 404
+    tile = tile_cache.get((z, x, y), lambda: render_tile(z, x, y))
+    if not is_resource_modified(request.environ, etag=tile.etag, last_modified=tile.last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(tile.html, mimetype='application/geo+json')
+    response.set_etag(tile.etag)
+    response.last_modified = tile.last_modified
+    response.headers['Cache-Control'] = 'private, max-age={0}'.format(app.config['TILE_MAX_AGE'])
+    return response
+
+
 @app.route('/student/my-tutors', methods=['POST', 'GET'])
 @login_required
 def student_followed_tutors():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
-    followed_tutors=user.followed.all()
+    user = profile_context().user
+    followed_tutors=user.followed.options(*tutor_card()).all()
     if user.username == current_user.username and not is_tutor(user):
-        student = Student.query.filter_by(user_id=user.id).first()
-        return render_template('my-tutors.html', profilepic= fetch_profile_pic(student), user=user, followed_tutors=followed_tutors)
+        student = profile_context().profile
+        recommendations = recommended_tutors(user.id, app.config['RECOMMENDATIONS_PER_USER'])
+        return render_template('my-tutors.html', profilepic=profile_context().avatar, user=user, followed_tutors=followed_tutors, recommendations=recommendations)
     elif user.username == current_user.username and is_tutor(user):
         return redirect(url_for('tutor_followers'))
         
@@ -571,7 +650,7 @@ def student_followed_tutors():
 def tutor():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if user.username == current_user.username and is_tutor(user):
         return redirect(url_for("profile",username=user.username))
     abort(404)
@@ -585,7 +664,7 @@ def tutor_location():
     form = MyLocationForm()
     google_api = app.config.get('GOOGLE_MAP_API_KEY')
     opencage_api = app.config.get('OPENCAGE_GEOCODE_API_KEY')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if form.validate_on_submit():
         user.update_location(
             latitude=form.latitude.data,
@@ -597,8 +676,8 @@ def tutor_location():
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student_location'))
     elif user.username == current_user.username and is_tutor(user):
-        tutor=Tutor.query.filter_by(user_id=user.id).first()
-        return render_template("my-location.html", user=user, tutor=tutor, profilepic= fetch_profile_pic(tutor), form=form, google_api_key=google_api,
+        tutor = profile_context().profile
+        return render_template("my-location.html", user=user, tutor=tutor, profilepic=profile_context().avatar, form=form, google_api_key=google_api,
             opencage_api_key=opencage_api, location=location)
 
 
@@ -608,16 +687,17 @@ def tutor_personal_info():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
     if is_tutor(current_user):
-        user = User.query.filter_by(username=current_user.username).first()
-        tutor=Tutor.query.filter_by(user_id=user.id).first()
+        user = profile_context().user
+        tutor = profile_context().profile
         form = PersonalInfoForm()
         form.create_state_choices()
         form.create_district_choices()
         if form.validate_on_submit():   
             if form.profile_pic.data:
-                if tutor.profile_pic:
+                profile_pic = save_picture(form.profile_pic.data)
+                if tutor.profile_pic and tutor.profile_pic != profile_pic:
                     delete_picture(tutor.profile_pic)
-                user.update_tutor(profile_pic = save_picture(form.profile_pic.data))
+                user.update_tutor(profile_pic = profile_pic)
             user.update_tutor(
                 full_name=form.name.data, 
                 state=form.state.data,
@@ -628,7 +708,7 @@ def tutor_personal_info():
                 phone = form.phone.data,
                 description = form.self_description.data
             )
-        return render_template("personal-info.html", user=user, user_obj=tutor, profilepic= fetch_profile_pic(tutor), form=form)
+        return render_template("personal-info.html", user=user, user_obj=tutor, profilepic=profile_context().avatar, form=form)
     else:
         return redirect(url_for('student_personal_info'))
 
@@ -639,11 +719,11 @@ def tutor_account_activities():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
     form = AccountInfoForm()
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student_account_info'))
     elif user.username == current_user.username and is_tutor(user):
-        tutor = Tutor.query.filter_by(user_id=user.id).first()
+        tutor = profile_context().profile
         if form.validate_on_submit():
             if not user.check_password(form.old_password.data):
                 flash("Wrong password!","danger")
@@ -653,7 +733,7 @@ def tutor_account_activities():
                 db.session.commit()
                 flash("Successfully changed password!", "success")
                 return redirect(url_for('tutor'))
-        return render_template("account-activities.html", user=user, tutor=tutor, profilepic=fetch_profile_pic(tutor), form=form)
+        return render_template("account-activities.html", user=user, tutor=tutor, profilepic=profile_context().avatar, form=form)
 
 
 @app.route('/tutor/my-courses', methods=['POST', 'GET'])
@@ -661,23 +741,23 @@ def tutor_account_activities():
 def tutor_courses():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     my_courses = Mycourse.query.filter_by(user_id=current_user.id)
     form = MyCourseForm()
     form.create_cost_choices()
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student'))
     elif user.username == current_user.username and is_tutor(user):
-        tutor=Tutor.query.filter_by(user_id=user.id).first()
+        tutor = profile_context().profile
         return render_template("my-courses.html", user=user, tutor=tutor,
-         profilepic=fetch_profile_pic(tutor), my_courses=my_courses ,form=form)
+         profilepic=profile_context().avatar, my_courses=my_courses ,form=form)
 
 
 @app.route('/tutor/delete/mycourse/<int:id>', methods=['POST', 'GET'])
 def delete_tutor_courses(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student'))
     elif user.username == current_user.username and is_tutor(user):
@@ -695,8 +775,8 @@ def tutor_educational_profile():
     form_experience = MyExperienceForm()
     form_qualification = MyQualificationForm()
     form_achievement = MyAchievementForm()
-    user = User.query.filter_by(username=current_user.username).first()
-    tutor=Tutor.query.filter_by(user_id=user.id).first()
+    user = profile_context().user
+    tutor = profile_context().profile
     if form_experience.validate_on_submit():
         experience = Experience(
             title=form_experience.title.data,
@@ -733,7 +813,7 @@ def tutor_educational_profile():
     achievements = Achievement.query.filter_by(tutor_id=user.id)
     experiences = Experience.query.filter_by(tutor_id=user.id)
     if user.username == current_user.username and is_tutor(user):
-        return render_template('my-educational-profile.html', profilepic=fetch_profile_pic(tutor), user=user, tutor=tutor, 
+        return render_template('my-educational-profile.html', profilepic=profile_context().avatar, user=user, tutor=tutor, 
             qualifications=qualifications, achievements=achievements, experiences=experiences,
             form_experience=form_experience, form_qualification=form_qualification, form_achievement=form_achievement)
     elif user.username == current_user.username and not is_tutor(user):
@@ -745,7 +825,7 @@ def tutor_educational_profile():
 def delete_tutor_experience(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
 
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student'))
@@ -762,7 +842,7 @@ def delete_tutor_experience(id):
 def delete_tutor_qualification(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
 
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student'))
@@ -779,7 +859,7 @@ def delete_tutor_qualification(id):
 def delete_tutor_achievement(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
 
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student'))
@@ -795,13 +875,13 @@ def delete_tutor_achievement(id):
 def tutor_followers():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
-    my_followers = user.followers.all()
+    user = profile_context().user
+    my_followers = user.followers.options(*student_card()).all()
     if user.username == current_user.username and not is_tutor(user):
         return redirect(url_for('student_followed_tutors'))
     elif user.username == current_user.username and is_tutor(user):
-        tutor=Tutor.query.filter_by(user_id=user.id).first()
-        return render_template('my-followers.html', profilepic=fetch_profile_pic(tutor), 
+        tutor = profile_context().profile
+        return render_template('my-followers.html', profilepic=profile_context().avatar, 
             tutor=tutor, user=user, my_followers=my_followers)
 
 
@@ -814,12 +894,16 @@ def courses():
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
     educational_level = request.args.get('educational_level', None)
-    if educational_level:
-        courses = Course.query.filter_by(course_level=educational_level)
-    else:
-        courses = Course.query.all()
-    user = User.query.filter_by(username=current_user.username).first()
-    return render_template('courses.html',profilepic=fetch_profile_pic(getattr(user, user.role)), courses=courses, user=user)
+
+    def render_catalogue():
+        if educational_level:
+            courses = Course.query.filter_by(course_level=educational_level)
+        else:
+            courses = Course.query.all()
+        return render_template('includes/course-catalogue.html', courses=courses)
+
+    fragment = course_fragments.get(('courses', educational_level), render_catalogue)
+    return render_cached_page('courses.html', fragment, profile_context().user, profile_context().avatar)
     
 
 @app.route('/courses/<int:id>')
@@ -827,9 +911,13 @@ def courses():
 def courses_by_id(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    course = Course.query.filter_by(id=id).first_or_404()
-    user = User.query.filter_by(username=current_user.username).first()
-    return render_template('course-details.html', course=course, profilepic=fetch_profile_pic(getattr(user, user.role)), user=user)
+
+    def render_course():
+        course = Course.query.filter_by(id=id).first_or_404()
+        return render_template('includes/course-details.html', course=course)
+
+    fragment = course_fragments.get(('course', id), render_course)
+    return render_cached_page('course-details.html', fragment, profile_context().user, profile_context().avatar)
 
 
 # MyCourse
@@ -840,7 +928,7 @@ def courses_by_id(id):
 def add_course(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     form = MyCourseForm()
     form.create_cost_choices()
     course= Course.query.filter_by(id=id).first_or_404()
@@ -852,7 +940,7 @@ def add_course(id):
             return redirect(url_for('tutor_courses'))
         else:
             return redirect(url_for('student_courses'))
-    return render_template('add-my-courses.html', form=form, profilepic=fetch_profile_pic(getattr(user, user.role)), user=user, course=course)
+    return render_template('add-my-courses.html', form=form, profilepic=profile_context().avatar, user=user, course=course)
 
 
 @app.route('/edit/my-course/<int:id>', methods=['GET','POST'])
@@ -860,7 +948,7 @@ def add_course(id):
 def edit_mycourse(id):
     if current_user.is_authenticated and current_user.role == 'admin':
         return redirect('/admin')
-    user = User.query.filter_by(username=current_user.username).first()
+    user = profile_context().user
     form = MyCourseForm()
     form.create_cost_choices()
     my_course = Mycourse.query.filter_by(id=id,User=user).first_or_404()
@@ -873,7 +961,7 @@ def edit_mycourse(id):
             return redirect(url_for('tutor_courses'))
         else:
             return redirect(url_for('student_courses'))
-    return render_template('edit-my-courses.html', form=form, profilepic=fetch_profile_pic(getattr(user, user.role)), user=user, course=my_course)
+    return render_template('edit-my-courses.html', form=form, profilepic=profile_context().avatar, user=user, course=my_course)
 
 
 # Error Handlers
@@ -889,4 +977,18 @@ def content_not_found_handler(e):
 def unauthorized_access_handler(e):
     """ For Handling 401 error """
     flash('You must be logged in to access this page!', 'danger')
-    return redirect(url_for('login'))
\ No newline at end of file
+    return redirect(url_for('login'))
+
+
+@app.errorhandler(413)
+def upload_too_large_handler(e):
+    """ For Handling 413 error """
+    flash('That upload is too large!', 'danger')
+    return redirect(request.url)
+
+
+@app.errorhandler(UploadRejected)
+def upload_rejected_handler(e):
+    """ For uploads refused by the size and pixel limits """
+    flash(str(e), 'danger')
+    return redirect(request.url)
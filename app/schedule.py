@@ -0,0 +1,113 @@
+import heapq
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import select
+
+from . import app, db
+from .models import User, Mycourse, Course, CourseMatch
+
+
+app.config.setdefault('SCHEDULE_MATCH_LIMIT', 5)
+
+# a Mycourse time range in minutes since midnight
+Slot = namedtuple('Slot', 'id user_id course_id start end')
+
+
+def minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def slot(mycourse_id, user_id, course_id, start, end):
+    """ A Slot for a Mycourse row, None if a time is unset or the range is empty """
+    if start is None or end is None:
+        return None
+    start, end = minutes(start), minutes(end)
+    if end <= start:
+        return None
+    return Slot(mycourse_id, user_id, course_id, start, end)
+
+
+def overlap_minutes(start, end, other_start, other_end):
+    """ Minutes two daily time ranges have in common, None if a time is unset """
+    if None in (start, end, other_start, other_end):
+        return None
+    return max(0, min(minutes(end), minutes(other_end)) - max(minutes(start), minutes(other_start)))
+
+
+def sweep(students, tutors):
+    """
+    Yield (student slot, tutor slot, minutes) for every overlapping pair.
+
+    Slots are visited by start time while a heap keyed on end time holds
+    the ones still open, so each slot only meets slots it overlaps:
+    O(n log n + k) for n slots and k overlapping pairs.
+    """
+    slots = sorted(
+        [(s.start, 0, s) for s in students] + [(t.start, 1, t) for t in tutors],
+        key=lambda item: (item[0], item[1])
+    )
+    open_slots = ({}, {})
+    ends = []
+    for start, side, current in slots:
+        while ends and ends[0][0] <= start:
+            _, closed_side, closed_id = heapq.heappop(ends)
+            open_slots[closed_side].pop(closed_id, None)
+        for other in open_slots[1 - side].values():
+            overlap = min(current.end, other.end) - start
+            yield (current, other, overlap) if side == 0 else (other, current, overlap)
+        open_slots[side][current.id] = current
+        heapq.heappush(ends, (current.end, side, current.id))
+
+
+def _slots(course_ids=None):
+    query = select([
+        Mycourse.id, Mycourse.user_id, Mycourse.course_id, Mycourse.time, Mycourse.endtime, User.role
+    ]).select_from(Mycourse.__table__.join(User.__table__, User.id == Mycourse.user_id)) \
+        .where(User.role.in_(('student', 'tutor')))
+    if course_ids is not None:
+        query = query.where(Mycourse.course_id.in_(course_ids))
+    by_course = {}
+    for mycourse_id, user_id, course_id, start, end, role in db.session.connection().execute(query):
+        current = slot(mycourse_id, user_id, course_id, start, end)
+        if current is not None:
+            sides = by_course.setdefault(course_id, ([], []))
+            sides[role == 'tutor'].append(current)
+    return by_course
+
+
+def course_overlaps(course_ids=None):
+    """
+    Bulk mode: {(student course id, tutor course id): minutes} for every
+    overlapping pair of the given courses (all courses by default), one
+    sweep per course.
+    """
+    overlaps = {}
+    for students, tutors in _slots(course_ids).values():
+        for student, tutor, overlap in sweep(students, tutors):
+            overlaps[student.id, tutor.id] = overlap
+    return overlaps
+
+
+ScheduleMatches = namedtuple('ScheduleMatches', 'Mycourse Course tutors')
+
+
+def schedule_matches(student_id, limit=None):
+    """
+    For each of the student's courses, the tutors whose slots overlap it,
+    most overlap minutes first; at most `limit` tutors per course.
+    """
+    rows = db.session.query(CourseMatch, User, Mycourse, Course) \
+        .join(User, User.id == CourseMatch.tutor_id) \
+        .join(Mycourse, Mycourse.id == CourseMatch.student_course_id) \
+        .join(Course, Course.id == CourseMatch.course_id) \
+        .filter(CourseMatch.student_id == student_id, CourseMatch.overlap_minutes > 0) \
+        .order_by(CourseMatch.student_course_id, CourseMatch.overlap_minutes.desc(), CourseMatch.distance_km) \
+        .all()
+    matches = OrderedDict()
+    for row in rows:
+        if row.Mycourse.id not in matches:
+            matches[row.Mycourse.id] = ScheduleMatches(row.Mycourse, row.Course, [])
+        tutors = matches[row.Mycourse.id].tutors
+        if limit is None or len(tutors) < limit:
+            tutors.append(row)
+    return list(matches.values())
@@ -0,0 +1,199 @@
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain
+
+from itsdangerous import BadSignature
+from sqlalchemy import Integer, cast, event, func, select, tuple_
+
+from . import app, db, ser
+from .models import User, Tutor, Mycourse, Course
+from .queries import joined_tutor
+
+
+app.config.setdefault('SEARCH_PAGE_SIZE', 20)
+app.config.setdefault('SEARCH_MAX_PAGE_SIZE', 50)
+
+CURSOR_SALT = 'tutor-search-cursor'
+# pages walk these account_verification_status groups in order; NULL is
+# left by rows from before the column defaulted to false
+VERIFICATION_GROUPS = (True, False, None)
+
+SearchResult = namedtuple('SearchResult', 'User Tutor Mycourse Course verified')
+
+_tutor = Tutor.__table__
+_mycourse = Mycourse.__table__
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _time(value):
+    try:
+        return datetime.strptime(value, '%H:%M').time()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_filters(args):
+    """ Read search filters from request args, dropping empty or invalid ones """
+    filters = {
+        'username': (args.get('username') or '').strip().lower() or None,
+        'course_level': args.get('course_level') or None,
+        'course_id': _int(args.get('course_id')),
+        'state': args.get('state') or None,
+        'district': args.get('district') or None,
+        'min_cost': _int(args.get('min_cost')),
+        'max_cost': _int(args.get('max_cost')),
+        'start': _time(args.get('start')),
+        'end': _time(args.get('end')),
+    }
+    return {key: value for key, value in filters.items() if value is not None}
+
+
+def page_size(value=None):
+    size = _int(value) or app.config['SEARCH_PAGE_SIZE']
+    return max(1, min(size, app.config['SEARCH_MAX_PAGE_SIZE']))
+
+
+def encode_cursor(tutor):
+    return ser.dumps(
+        [tutor.account_verification_status, tutor.min_cost, tutor.user_id], salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor):
+    try:
+        verified, cost, user_id = ser.loads(cursor, salt=CURSOR_SALT)
+        group = VERIFICATION_GROUPS.index(verified)
+        return group, int(cost), int(user_id)
+    except (BadSignature, TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def _course_conditions(filters):
+    conditions = []
+    if 'course_level' in filters:
+        conditions.append(Course.course_level == filters['course_level'])
+    if 'course_id' in filters:
+        conditions.append(Mycourse.course_id == filters['course_id'])
+    if 'min_cost' in filters:
+        conditions.append(Mycourse.cost >= filters['min_cost'])
+    if 'max_cost' in filters:
+        conditions.append(Mycourse.cost <= filters['max_cost'])
+    if 'start' in filters:
+        conditions.append(Mycourse.time >= filters['start'])
+    if 'end' in filters:
+        conditions.append(Mycourse.endtime <= filters['end'])
+    return conditions
+
+
+def _verification(group):
+    column = Tutor.account_verification_status
+    return column.is_(None) if group is None else column == group
+
+
+def _cheapest_offerings(user_ids, conditions):
+    """ {tutor id: (Mycourse, Course)} of each tutor's cheapest offering matching `conditions` """
+    if not user_ids:
+        return {}
+    offerings = {}
+    for mycourse, course in db.session.query(Mycourse, Course).join(Course) \
+            .filter(Mycourse.user_id.in_(user_ids), *conditions) \
+            .order_by(Mycourse.user_id, Mycourse.cost, Mycourse.id):
+        offerings.setdefault(mycourse.user_id, (mycourse, course))
+    return offerings
+
+
+def find_tutors(filters, cursor=None, per_page=None):
+    """
+    Return one page of SearchResult rows, one per tutor matching `filters`,
+    plus the cursor of the next page. Course filters select tutors with at
+    least one matching offering, shown with the cheapest of them; tutors
+    without courses are found by the other filters.
+
+    Tutors are ordered by verification, then cheapest offering
+    (Tutor.min_cost), then id. Each verification group is read as a range
+    of ix_tutor_search_order continuing from the last row seen, so a page
+    costs the same however deep the student scrolls.
+    """
+    per_page = page_size(per_page)
+    conditions = _course_conditions(filters)
+    query = db.session.query(User, Tutor).select_from(Tutor).join(User, User.id == Tutor.user_id) \
+        .filter(User.role == 'tutor').options(*joined_tutor())
+    if 'username' in filters:
+        query = query.filter(User.username == filters['username'])
+    if 'state' in filters:
+        query = query.filter(Tutor.state == filters['state'])
+    if 'district' in filters:
+        query = query.filter(Tutor.district == filters['district'])
+    if conditions:
+        query = query.filter(db.session.query(Mycourse.id).join(Course)
+            .filter(Mycourse.user_id == Tutor.user_id, *conditions).exists())
+
+    first_group, last_key = 0, None
+    if cursor:
+        first_group, last_cost, last_id = decode_cursor(cursor)
+        last_key = tuple_(last_cost, last_id)
+    rows = []
+    for index in range(first_group, len(VERIFICATION_GROUPS)):
+        group_query = query.filter(_verification(VERIFICATION_GROUPS[index]))
+        if last_key is not None and index == first_group:
+            group_query = group_query.filter(tuple_(Tutor.min_cost, Tutor.user_id) > last_key)
+        rows += group_query.order_by(Tutor.min_cost, Tutor.user_id).limit(per_page + 1 - len(rows)).all()
+        if len(rows) > per_page:
+            break
+
+    page = rows[:per_page]
+    offerings = _cheapest_offerings([tutor.user_id for _, tutor in page], conditions)
+    results = [
+        SearchResult(user, tutor, *offerings.get(tutor.user_id, (None, None)),
+            bool(tutor.account_verification_status))
+        for user, tutor in page
+    ]
+    next_cursor = encode_cursor(page[-1].Tutor) if len(rows) > per_page else None
+    return results, next_cursor
+
+
+def refresh_min_costs(connection, user_ids=None):
+    """ Recompute Tutor.min_cost for `user_ids`, or for every tutor """
+    cheapest = select([func.coalesce(func.min(cast(_mycourse.c.cost, Integer)), 0)]) \
+        .where(_mycourse.c.user_id == _tutor.c.user_id).as_scalar()
+    update = _tutor.update().values(min_cost=cheapest)
+    if user_ids is not None:
+        update = update.where(_tutor.c.user_id.in_(user_ids))
+    connection.execute(update)
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_min_costs(session, flush_context):
+    user_ids = {
+        obj.user_id for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, Mycourse)
+    }
+    user_ids.discard(None)
+    if user_ids:
+        refresh_min_costs(session.connection(), user_ids)
+
+
+def serialize_result(row):
+    offering = row.Mycourse
+    return {
+        'username': row.User.username,
+        'full_name': row.Tutor.full_name,
+        'verified': row.verified,
+        'district': row.Tutor.district,
+        'state': row.Tutor.state,
+        'course_id': row.Course.id if row.Course else None,
+        'course_title': row.Course.course_title if row.Course else None,
+        'course_level': row.Course.course_level if row.Course else None,
+        'cost': offering.cost if offering else None,
+        'time': offering.time.strftime('%H:%M') if offering and offering.time else None,
+        'endtime': offering.endtime.strftime('%H:%M') if offering and offering.endtime else None,
+    }
@@ -0,0 +1,146 @@
+import json
+import os
+from math import asinh, atan, degrees, floor, pi, radians, sinh, tan
+
+from flask import url_for
+from sqlalchemy import and_, event, select
+from sqlalchemy.orm import object_session
+
+from . import app, db
+from .fragments import FragmentCache
+from .geo import box_filter
+from .models import User, Tutor, Location
+
+
+app.config.setdefault('TILE_MAX_ZOOM', 20)
+# up to this zoom, markers within TILE_CLUSTER_PIXELS of each other on
+# screen are drawn as one cluster
+app.config.setdefault('TILE_CLUSTER_MAX_ZOOM', 15)
+app.config.setdefault('TILE_CLUSTER_PIXELS', 64)
+app.config.setdefault('TILE_CACHE_SIZE', 1024)
+app.config.setdefault('TILE_CACHE_STAMP', os.path.join(app.instance_path, 'tile-cache.stamp'))
+app.config.setdefault('TILE_MAX_AGE', 60)
+
+TILE_PIXELS = 256
+
+_user = User.__table__
+_tutor = Tutor.__table__
+_location = Location.__table__
+
+
+def pixel(lat, lng, zoom):
+    """ Web Mercator pixel coordinates of a coordinate at `zoom` """
+    scale = TILE_PIXELS * 2 ** zoom
+    return (lng + 180) / 360 * scale, (1 - asinh(tan(radians(lat))) / pi) / 2 * scale
+
+
+def _tile_lat(y, zoom):
+    return degrees(atan(sinh(pi * (1 - 2 * y / 2 ** zoom))))
+
+
+def tile_bounds(zoom, x, y):
+    """ (min_lat, min_lng, max_lat, max_lng) of a tile """
+    return (
+        _tile_lat(y + 1, zoom),
+        x / 2 ** zoom * 360 - 180,
+        _tile_lat(y, zoom),
+        (x + 1) / 2 ** zoom * 360 - 180,
+    )
+
+
+def valid_tile(zoom, x, y):
+    return 0 <= zoom <= app.config['TILE_MAX_ZOOM'] and 0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom
+
+
+def _tutors_in_tile(zoom, x, y):
+    """ (row, pixel x, pixel y) for each tutor on a tile """
+    min_lat, min_lng, max_lat, max_lng = tile_bounds(zoom, x, y)
+    rows = db.session.connection().execute(
+        select([_user.c.username, _tutor.c.full_name, _location.c.latitude, _location.c.longitude])
+        .select_from(_user.join(_location).outerjoin(_tutor))
+        .where(and_(_user.c.role == 'tutor', box_filter(min_lat, min_lng, max_lat, max_lng)))
+        .order_by(_user.c.id))
+    left, top = x * TILE_PIXELS, y * TILE_PIXELS
+    for row in rows:
+        if row.latitude is None or row.longitude is None:
+            continue
+        px, py = pixel(row.latitude, row.longitude, zoom)
+        # the grid cells overhang the tile; a point on an edge belongs to one tile
+        if left <= px < left + TILE_PIXELS and top <= py < top + TILE_PIXELS:
+            yield row, px, py
+
+
+def _point(lat, lng):
+    return {'type': 'Point', 'coordinates': [round(lng, 6), round(lat, 6)]}
+
+
+def _tutor_feature(row):
+    return {'type': 'Feature', 'geometry': _point(row.latitude, row.longitude), 'properties': {
+        'username': row.username,
+        'name': row.full_name or row.username,
+        'url': url_for('profile', username=row.username),
+    }}
+
+
+def tile_features(zoom, x, y):
+    """
+    GeoJSON features for the tutors on a tile. Up to TILE_CLUSTER_MAX_ZOOM
+    tutors are grouped into square cells of TILE_CLUSTER_PIXELS on screen,
+    which divide the tile evenly, so no cluster spans two tiles; a cell
+    with several tutors is one feature at their centroid with a count.
+    """
+    if zoom > app.config['TILE_CLUSTER_MAX_ZOOM']:
+        return [_tutor_feature(row) for row, _, _ in _tutors_in_tile(zoom, x, y)]
+    size = app.config['TILE_CLUSTER_PIXELS']
+    cells = {}
+    for row, px, py in _tutors_in_tile(zoom, x, y):
+        cells.setdefault((int(floor(px / size)), int(floor(py / size))), []).append(row)
+    features = []
+    for key in sorted(cells):
+        rows = cells[key]
+        if len(rows) == 1:
+            features.append(_tutor_feature(rows[0]))
+            continue
+        lat = sum(row.latitude for row in rows) / len(rows)
+        lng = sum(row.longitude for row in rows) / len(rows)
+        features.append({'type': 'Feature', 'geometry': _point(lat, lng),
+            'properties': {'cluster': True, 'count': len(rows)}})
+    return features
+
+
+def render_tile(zoom, x, y):
+    return json.dumps({'type': 'FeatureCollection', 'features': tile_features(zoom, x, y)}, separators=(',', ':'))
+
+
+tile_cache = FragmentCache(app.config['TILE_CACHE_SIZE'], app.config['TILE_CACHE_STAMP'])
+
+
+# what a tile shows of each row; other updates, e.g. follower counts, leave tiles alone
+_TILE_ATTRIBUTES = {User: ('username', 'role'), Tutor: ('full_name',)}
+
+
+@event.listens_for(Location, 'after_insert')
+@event.listens_for(Location, 'after_update')
+@event.listens_for(Location, 'after_delete')
+@event.listens_for(User, 'after_delete')
+def _tiles_changed(mapper, connection, target):
+    object_session(target).info['tiles_changed'] = True
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(Tutor, 'after_update')
+def _tile_attributes_changed(mapper, connection, target):
+    state = db.inspect(target)
+    if any(getattr(state.attrs, name).history.has_changes() for name in _TILE_ATTRIBUTES[type(target)]):
+        object_session(target).info['tiles_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_tiles(session):
+    if session.info.pop('tiles_changed', False):
+        tile_cache.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_tile_changes(session):
+    session.info.pop('tiles_changed', None)
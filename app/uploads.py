@@ -0,0 +1,57 @@
+import os
+import hashlib
+import tempfile
+
+from . import app
+
+
+app.config.setdefault('UPLOAD_CHUNK_SIZE', 64 * 1024)
+app.config.setdefault('DOCS_MAX_BYTES', 10 * 1024 * 1024)
+app.config.setdefault('PROFILE_PIC_MAX_BYTES', 5 * 1024 * 1024)
+app.config.setdefault('PROFILE_PIC_MAX_PIXELS', 24 * 1000 * 1000)
+
+
+class UploadRejected(ValueError):
+    """ An upload that breaks a size or format limit; the message is user-facing """
+
+
+def spool_upload(upload, directory, max_bytes):
+    """
+    Copy an uploaded file into a temporary file in `directory` in fixed-size
+    chunks, hashing it on the way. Returns the temporary path and the SHA-256
+    hex digest.
+
+    Reading stops as soon as `max_bytes` is exceeded, so memory use is one
+    chunk regardless of the upload size.
+    """
+    if upload.content_length and upload.content_length > max_bytes:
+        raise UploadRejected(_too_large(max_bytes))
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    digest = hashlib.sha256()
+    written = 0
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in iter(lambda: upload.stream.read(chunk_size), b''):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadRejected(_too_large(max_bytes))
+                digest.update(chunk)
+                temp_file.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+def move_into_place(temp_path, path):
+    """ Atomically publish a spooled file, dropping it if `path` already exists """
+    if os.path.exists(path):
+        os.remove(temp_path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+
+
+def _too_large(max_bytes):
+    return 'File is too large, the limit is {0} MB.'.format(round(max_bytes / (1024 * 1024), 1))
@@ -0,0 +1,137 @@
+"""
+Query plans and timings of the hot-path queries without and with the
+indexes of migration e2c6a8f41b93, on a seeded SQLite database.
+
+    SECRET_KEY=x python -m bench.indexes --tutors 2000 --students 20000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='fyt-bench-'), 'bench.db')
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db  # noqa: E402
+from app.matching import _pairs, student_matches  # noqa: E402
+from app.models import (  # noqa: E402
+    User, Course, Mycourse, Experience, Qualification, Achievement
+)
+from app.profiler import explain  # noqa: E402
+from bench.seed import seed, COURSE_LEVELS  # noqa: E402
+
+
+INDEXES = (
+    'ix_mycourse_user_id',
+    'ix_mycourse_course_id_cost',
+    'ix_experience_tutor_id',
+    'ix_qualification_tutor_id',
+    'ix_achievement_tutor_id',
+    'ix_course_course_level',
+    'ix_followers_followed_id',
+)
+
+
+def scenarios(tutor_id, student_id):
+    """ (name, callable) for each hot query, written as the routes write it """
+    return (
+        ('my courses', lambda: db.session.query(Mycourse, Course).join(Course)
+            .filter(Mycourse.user_id == student_id).all()),
+        ('course match refresh, student', lambda: list(_pairs(db.session.connection(), [student_id]))),
+        ('course match refresh, tutor', lambda: list(_pairs(db.session.connection(), [tutor_id]))),
+        ('ranked student matches', lambda: len(student_matches(student_id))),
+        ('tutors of a course by cost', lambda: Mycourse.query.filter(Mycourse.course_id == 1)
+            .order_by(Mycourse.cost).all()),
+        ('courses by level', lambda: Course.query.filter_by(course_level=COURSE_LEVELS[2]).all()),
+        ('educational profile', lambda: (
+            Experience.query.filter_by(tutor_id=tutor_id).all(),
+            Qualification.query.filter_by(tutor_id=tutor_id).all(),
+            Achievement.query.filter_by(tutor_id=tutor_id).all())),
+        ('my followers', lambda: User.query.get(tutor_id).followers.all()),
+        ('is following', lambda: User.query.get(student_id).is_following(User.query.get(tutor_id))),
+    )
+
+
+def _index(name):
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(name)
+
+
+def measure(tutor_id, student_id, repeat):
+    """ {name: (median ms, plans)} """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((conn, statement, parameters))
+
+    results = {}
+    for name, run in scenarios(tutor_id, student_id):
+        db.session.expire_all()
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            run()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        plans = []
+        for conn, statement, parameters in statements:
+            if statement.lstrip().upper().startswith('SELECT'):
+                plans.append(explain(conn, statement, parameters))
+        statements.clear()
+        timings = []
+        for _ in range(repeat):
+            db.session.expire_all()
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = (statistics.median(timings), plans)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tutors', type=int, default=2000)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--courses', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app.config['SQL_SLOW_QUERY_MS'] = float('inf')
+    with app.app_context():
+        db.create_all()
+        connection = db.session.connection()
+        counts = seed(connection, tutors=args.tutors, students=args.students,
+            courses=args.courses, random_seed=args.seed)
+        db.session.commit()
+        print('Seeded', ', '.join('{0} {1}'.format(n, table) for table, n in counts.items()))
+        tutor_id, student_id = 1, args.tutors + 1
+
+        for name in INDEXES:
+            _index(name).drop(db.engine)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+        before = measure(tutor_id, student_id, args.repeat)
+
+        for name in INDEXES:
+            _index(name).create(db.engine)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+        after = measure(tutor_id, student_id, args.repeat)
+
+    for name, (before_ms, before_plans) in before.items():
+        after_ms, after_plans = after[name]
+        print('\n== {0}: {1:.2f} ms -> {2:.2f} ms ({3:.1f}x)'.format(
+            name, before_ms, after_ms, before_ms / after_ms if after_ms else float('inf')))
+        for label, plans in (('before', before_plans), ('after', after_plans)):
+            for plan in plans:
+                print('  {0}: {1}'.format(label, plan.replace('\n', '\n          ')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Load scenarios (login, student dashboard, search, profile view, follow,
+course add) against a seeded database, through Flask's test client or a
+local gunicorn, reporting throughput and latency percentiles.
+
+    SECRET_KEY=x python -m bench.load --tutors 1000 --students 5000
+    SECRET_KEY=x python -m bench.load --gunicorn 4 --concurrency 8 --json after.json
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='fyt-bench-'), 'bench.db')
+
+from app import app, db  # noqa: E402
+from bench.seed import seed, rebuild_derived, PASSWORD, SUBJECTS  # noqa: E402
+
+
+_CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class TestClient:
+    """ Requests through Flask's test client, inside this process """
+
+    def __init__(self):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self._client.open(path, method=method, data=data)
+        return response.status_code, response.headers.get('Location'), response.get_data(as_text=True)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """ Requests over HTTP to a running server, with a cookie jar """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self._opener.open(request) as response:
+                return response.status, response.headers.get('Location'), response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Location'), e.read().decode('utf-8', 'replace')
+
+
+def _submit(client, path, data):
+    """ GET the form at `path`, then POST it with its CSRF token """
+    body = client.request('GET', path)[2]
+    token = _CSRF_TOKEN.search(body)
+    if token:
+        data = dict(data, csrf_token=token.group(1))
+    return client.request('POST', path, data)
+
+
+def _redirected(response):
+    # a redirect that is not the login page bouncing an anonymous user
+    status, location, _ = response
+    return status == 302 and '/login' not in (location or '')
+
+
+def login(client, email):
+    return _redirected(_submit(client, '/login', {'email': email, 'password': PASSWORD}))
+
+
+class Scenarios:
+    """ One user action each; returns True if the response was as expected """
+
+    def __init__(self, tutors, students, courses, new_client):
+        self.tutors, self.students, self.courses = tutors, students, courses
+        self.new_client = new_client
+
+    def student_email(self, rng):
+        return 'student{0}@example.com'.format(rng.randrange(self.tutors + 1, self.tutors + self.students + 1))
+
+    def tutor_username(self, rng):
+        return 'tutor{0}'.format(rng.randrange(1, self.tutors + 1))
+
+    def login(self, client, rng):
+        return login(self.new_client(), self.student_email(rng))
+
+    def dashboard(self, client, rng):
+        return client.request('GET', '/student')[0] == 200
+
+    def search(self, client, rng):
+        if rng.random() < 0.5:
+            query = {'q': rng.choice(SUBJECTS)}
+        else:
+            query = {'course_level': 'Bachelor Level', 'max_cost': rng.randrange(2000, 10000, 1000)}
+        return client.request('GET', '/student/search-tutors?' + urllib.parse.urlencode(query))[0] == 200
+
+    def profile(self, client, rng):
+        return client.request('GET', '/profiles/' + self.tutor_username(rng))[0] == 200
+
+    def follow(self, client, rng):
+        return _redirected(client.request('GET', '/follow/' + self.tutor_username(rng)))
+
+    def course_add(self, client, rng):
+        start = rng.randrange(6, 20)
+        return _redirected(_submit(client, '/my-courses/add/{0}'.format(rng.randrange(1, self.courses + 1)), {
+            'education_level': 'Bachelor Level',
+            'course': 'Synthetic',
+            'cost': rng.randrange(1000, 10000, 1000),
+            'starttime': '{0:02d}:00'.format(start),
+            'endtime': '{0:02d}:00'.format(start + 1),
+        }))
+
+    NAMES = ('login', 'dashboard', 'search', 'profile', 'follow', 'course_add')
+
+
+def percentile(samples, q):
+    """ Nearest-rank percentile of sorted `samples` """
+    if not samples:
+        return None
+    return samples[max(0, math.ceil(q * len(samples)) - 1)]
+
+
+def run_scenario(name, scenarios, requests, concurrency, random_seed):
+    """ Run `requests` actions on `concurrency` threads, each logged in as its own student """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def worker(index, count):
+        rng = random.Random(random_seed * 1000 + index)
+        client = scenarios.new_client()
+        if not login(client, scenarios.student_email(rng)):
+            raise RuntimeError('could not log in')
+        action = getattr(scenarios, name)
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                ok = action(client, rng)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    counts = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(index, count)) for index, count in enumerate(counts)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # includes each worker's untimed login, so throughput is a lower bound
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput': len(latencies) / wall if wall else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers):
+    """ A gunicorn serving wsgi:app on the benchmark database, and its URL """
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', '127.0.0.1:{0}'.format(port),
+            '--log-level', 'warning', 'wsgi:app'],
+        cwd=os.path.dirname(app.root_path), env=dict(os.environ))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited with status {0}'.format(process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process, 'http://127.0.0.1:{0}'.format(port)
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start listening')
+
+
+def report(results):
+    columns = ('requests', 'errors', 'throughput', 'p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    print('{0:<12}'.format('scenario') + ''.join('{0:>12}'.format(column) for column in columns))
+    for name, result in results.items():
+        print('{0:<12}'.format(name) + ''.join(
+            '{0:>12.1f}'.format(result[column]) if isinstance(result[column], float) else '{0:>12}'.format(result[column])
+            for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tutors', type=int, default=1000)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--courses', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=200, help='actions per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--scenario', action='append', choices=Scenarios.NAMES,
+        help='run only these scenarios (repeatable)')
+    parser.add_argument('--gunicorn', type=int, metavar='WORKERS',
+        help='serve through a local gunicorn with this many workers instead of the test client')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    app.config['SQL_SLOW_QUERY_MS'] = float('inf')
+    with app.app_context():
+        db.create_all()
+        seed(db.session.connection(), tutors=args.tutors, students=args.students,
+            courses=args.courses, random_seed=args.seed)
+        db.session.commit()
+        rebuild_derived()
+
+    server = None
+    if args.gunicorn:
+        server, base_url = start_gunicorn(args.gunicorn)
+        new_client = lambda: HttpClient(base_url)  # noqa: E731
+    else:
+        new_client = TestClient
+    try:
+        scenarios = Scenarios(args.tutors, args.students, args.courses, new_client)
+        results = {
+            name: run_scenario(name, scenarios, args.requests, args.concurrency, args.seed)
+            for name in args.scenario or Scenarios.NAMES
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
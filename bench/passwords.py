@@ -0,0 +1,80 @@
+"""
+Calibrate the password hashing parameters on this machine: the largest
+PBKDF2 iteration count and scrypt N whose verify stays within a target
+time, printed as settings for .env.
+
+    SECRET_KEY=x python -m bench.passwords --target-ms 100
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app.passwords import Pbkdf2Hasher, ScryptHasher, verify_password  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+SALT = 'x' * 32
+
+
+def timed(hasher, repeat):
+    """ Median ms to derive one hash """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        hasher.derive(hasher.method, SALT, PASSWORD)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_pbkdf2(target_ms, repeat):
+    # cost is linear in the iterations, so scale a measured run
+    probe = Pbkdf2Hasher(50000)
+    iterations = int(50000 * target_ms / timed(probe, repeat)) // 10000 * 10000
+    hasher = Pbkdf2Hasher(max(iterations, 10000))
+    return hasher, timed(hasher, repeat)
+
+
+def calibrate_scrypt(target_ms, repeat, r, p):
+    # N must be a power of two; double it while the verify fits
+    hasher, elapsed = ScryptHasher(2 ** 10, r, p), None
+    while True:
+        candidate = ScryptHasher(hasher.n * 2, r, p)
+        candidate_ms = timed(candidate, repeat)
+        if candidate_ms > target_ms:
+            return hasher, elapsed if elapsed is not None else timed(hasher, repeat)
+        hasher, elapsed = candidate, candidate_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target-ms', type=float, default=100, help='verify time to aim for')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scrypt-r', type=int, default=8)
+    parser.add_argument('--scrypt-p', type=int, default=1)
+    args = parser.parse_args()
+
+    legacy = generate_password_hash(PASSWORD)
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        verify_password(legacy, PASSWORD)
+        timings.append((time.perf_counter() - started) * 1000)
+    print('werkzeug default ({0}): {1:.1f} ms'.format(legacy.split('$', 1)[0], statistics.median(timings)))
+
+    pbkdf2, pbkdf2_ms = calibrate_pbkdf2(args.target_ms, args.repeat)
+    print('{0}: {1:.1f} ms'.format(pbkdf2.method, pbkdf2_ms))
+    scrypt, scrypt_ms = calibrate_scrypt(args.target_ms, args.repeat, args.scrypt_r, args.scrypt_p)
+    print('{0}: {1:.1f} ms, {2} MiB'.format(scrypt.method, scrypt_ms, 128 * scrypt.n * scrypt.r // 2 ** 20))
+
+    print('\n# for .env; scrypt also costs memory, which slows GPU and ASIC guessing')
+    print('PASSWORD_HASHER=scrypt')
+    print('PASSWORD_SCRYPT_N={0}'.format(scrypt.n))
+    print('PASSWORD_PBKDF2_ITERATIONS={0}'.format(pbkdf2.iterations))
+
+
+if __name__ == '__main__':
+    main()
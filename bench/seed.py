@@ -0,0 +1,212 @@
+"""
+Seeded synthetic data for the benchmarks.
+
+Users are spread over the districts of districts.json, weighted towards
+the cities, and scattered around each district's headquarters. Rows are
+written with bulk Core inserts, so the ORM flush hooks (full-text index,
+course matches, recommendations, tutors' cheapest cost) do not run; `seed`
+fills in the costs and `rebuild_derived` the tables afterwards.
+"""
+import json
+import os
+import random
+from datetime import time
+
+from werkzeug.security import generate_password_hash
+
+from app import app
+from app.geo import grid_cell
+from app.models import (
+    User, Student, Tutor, Location, Course, Mycourse,
+    Experience, Qualification, Achievement, followers
+)
+from app.search import refresh_min_costs
+
+
+PASSWORD = 'benchmark'
+COURSE_LEVELS = (
+    'Basic Education(Grade 1-8)',
+    'Secondary Education(Grade 9-12)',
+    'Bachelor Level',
+    'Master Level',
+)
+SUBJECTS = (
+    'Mathematics', 'Physics', 'Chemistry', 'Biology', 'English', 'Nepali',
+    'Accountancy', 'Economics', 'Computer Science', 'Statistics',
+)
+# approximate district headquarters; users are scattered around them
+DISTRICT_CENTRES = {
+    'Bhojpur': (27.17, 87.05), 'Dhankuta': (26.98, 87.34), 'Ilam': (26.91, 87.93),
+    'Jhapa': (26.55, 87.98), 'Khotang': (27.21, 86.79), 'Morang': (26.45, 87.27),
+    'Okhaldhunga': (27.31, 86.50), 'Panchthar': (27.15, 87.76), 'Sankhuwasabha': (27.37, 87.21),
+    'Solukhumbu': (27.50, 86.58), 'Sunsari': (26.61, 87.15), 'Taplejung': (27.35, 87.67),
+    'Terhathum': (27.13, 87.49), 'Udayapur': (26.80, 86.70),
+    'Saptari': (26.54, 86.75), 'Siraha': (26.65, 86.21), 'Dhanusa': (26.73, 85.93),
+    'Mahottari': (26.65, 85.80), 'Sarlahi': (26.86, 85.56), 'Bara': (27.03, 85.00),
+    'Parsa': (27.01, 84.88), 'Rautahat': (26.77, 85.28),
+    'Sindhuli': (27.21, 85.91), 'Ramechhap': (27.40, 86.06), 'Dolakha': (27.67, 86.05),
+    'Bhaktapur': (27.67, 85.43), 'Dhading': (27.87, 84.90), 'Kathmandu': (27.72, 85.32),
+    'Kavrepalanchok': (27.62, 85.55), 'Lalitpur': (27.66, 85.32), 'Nuwakot': (27.92, 85.15),
+    'Rasuwa': (28.11, 85.30), 'Sindhupalchok': (27.78, 85.72), 'Chitwan': (27.68, 84.43),
+    'Makwanpur': (27.43, 85.03),
+    'Baglung': (28.27, 83.59), 'Gorkha': (28.00, 84.63), 'Kaski': (28.21, 83.99),
+    'Lamjung': (28.23, 84.38), 'Manang': (28.55, 84.24), 'Mustang': (28.78, 83.73),
+    'Myagdi': (28.35, 83.57), 'Nawalpur': (27.64, 84.13), 'Parbat': (28.22, 83.69),
+    'Syangja': (28.09, 83.87), 'Tanahun': (27.97, 84.27),
+    'Kapilvastu': (27.54, 83.05), 'Parasi': (27.53, 83.67), 'Rupandehi': (27.50, 83.45),
+    'Arghakhanchi': (27.98, 83.13), 'Gulmi': (28.07, 83.25), 'Palpa': (27.87, 83.55),
+    'Dang': (28.04, 82.49), 'Pyuthan': (28.10, 82.86), 'Rolpa': (28.30, 82.64),
+    'Rukum ( Eastern )': (28.60, 82.63), 'Banke': (28.05, 81.62), 'Bardiya': (28.21, 81.35),
+    'Rukum ( Western )': (28.63, 82.48), 'Salyan': (28.38, 82.16), 'Dolpa': (28.94, 82.91),
+    'Humla': (29.97, 81.82), 'Jumla': (29.27, 82.18), 'Kalikot': (29.14, 81.60),
+    'Mugu': (29.55, 82.15), 'Surkhet': (28.60, 81.62), 'Dailekh': (28.84, 81.71),
+    'Jajarkot': (28.70, 82.20),
+    'Kailali': (28.69, 80.60), 'Achham': (29.15, 81.28), 'Doti': (29.26, 80.94),
+    'Bajhang': (29.55, 81.20), 'Bajura': (29.45, 81.47), 'Kanchanpur': (28.96, 80.18),
+    'Dadeldhura': (29.30, 80.58), 'Baitadi': (29.53, 80.43), 'Darchula': (29.85, 80.55),
+}
+# relative share of users: the valley and the large Terai and hill cities
+# hold most of them
+DISTRICT_WEIGHTS = {
+    'Kathmandu': 20, 'Lalitpur': 5, 'Bhaktapur': 3, 'Morang': 5, 'Rupandehi': 5,
+    'Jhapa': 4, 'Sunsari': 4, 'Kaski': 4, 'Chitwan': 4, 'Kailali': 4,
+    'Dhanusa': 3, 'Parsa': 3, 'Banke': 3, 'Dang': 3, 'Makwanpur': 2, 'Surkhet': 2,
+}
+SCATTER_DEGREES = 0.08
+BATCH = 5000
+
+
+def districts():
+    """ (state, district) pairs of districts.json """
+    with open(os.path.join(os.path.dirname(app.root_path), 'districts.json')) as f:
+        return [(state.strip("'"), district) for state, names in json.load(f).items() for district in names]
+
+
+def _insert(connection, table, rows):
+    for start in range(0, len(rows), BATCH):
+        connection.execute(table.insert(), rows[start:start + BATCH])
+
+
+def _slot(rng):
+    start = rng.randrange(6, 20)
+    return time(start, rng.choice((0, 30))), time(start + rng.choice((1, 2)), 0)
+
+
+def _certificate(rng):
+    # a content-addressed document name, as app.docstore stores them; the
+    # file itself is not written
+    digest = '%064x' % rng.getrandbits(256)
+    return '{0}/{1}.pdf'.format(digest[:2], digest)
+
+
+def seed(connection, tutors=1000, students=5000, courses=200, courses_per_user=3,
+        follows_per_student=5, profile_rows=2, random_seed=0):
+    """
+    Fill an empty database. The same arguments always give the same rows;
+    every user's password is PASSWORD. Returns the number of rows per table.
+    """
+    rng = random.Random(random_seed)
+    places = districts()
+    place_weights = [DISTRICT_WEIGHTS.get(district, 1) for _, district in places]
+    password = generate_password_hash(PASSWORD)
+
+    _insert(connection, Course.__table__, [
+        {
+            'id': course_id,
+            'course_title': '{0} {1}'.format(rng.choice(SUBJECTS), course_id),
+            'course_level': rng.choice(COURSE_LEVELS),
+            'course_description': 'Synthetic course {0}'.format(course_id),
+        }
+        for course_id in range(1, courses + 1)
+    ])
+
+    users, profiles, locations, mycourses = [], {'tutor': [], 'student': []}, [], []
+    for user_id in range(1, tutors + students + 1):
+        role = 'tutor' if user_id <= tutors else 'student'
+        users.append({
+            'id': user_id,
+            'username': '{0}{1}'.format(role, user_id),
+            'email': '{0}{1}@example.com'.format(role, user_id),
+            'hash_password': password,
+            'role': role,
+            'confirmed_account': True,
+        })
+        state, district = rng.choices(places, place_weights)[0]
+        profile = {
+            'user_id': user_id,
+            'full_name': '{0} {1}'.format(role.title(), user_id),
+            'state': state,
+            'district': district,
+            'description': '{0} in {1}'.format(rng.choice(SUBJECTS), district),
+        }
+        if role == 'tutor':
+            profile['account_verification_status'] = rng.random() < 0.3
+        profiles[role].append(profile)
+        centre = DISTRICT_CENTRES[district]
+        lat = centre[0] + rng.gauss(0, SCATTER_DEGREES)
+        lng = centre[1] + rng.gauss(0, SCATTER_DEGREES)
+        locations.append({
+            'user_id': user_id, 'latitude': lat, 'longitude': lng, 'grid_cell': grid_cell(lat, lng),
+            'place_details': district,
+        })
+        for course_id in rng.sample(range(1, courses + 1), min(courses_per_user, courses)):
+            start, end = _slot(rng)
+            mycourses.append({
+                'user_id': user_id, 'course_id': course_id, 'time': start, 'endtime': end,
+                'cost': rng.randrange(1000, 10000, 1000),
+            })
+
+    tutor_ids = range(1, tutors + 1)
+    follows = set()
+    # a few popular tutors draw most of the follows
+    weights = [1.0 / rank for rank in range(1, tutors + 1)]
+    for user_id in range(tutors + 1, tutors + students + 1):
+        for tutor_id in rng.choices(tutor_ids, weights, k=follows_per_student):
+            follows.add((user_id, tutor_id))
+    follows = [{'follower_id': a, 'followed_id': b} for a, b in sorted(follows)]
+    follower_count = {}
+    for row in follows:
+        follower_count[row['followed_id']] = follower_count.get(row['followed_id'], 0) + 1
+    for user in users:
+        user['follower_count'] = follower_count.get(user['id'], 0)
+        user['following_count'] = 0
+    for row in follows:
+        users[row['follower_id'] - 1]['following_count'] += 1
+
+    details = {Experience: [], Qualification: [], Achievement: []}
+    for tutor_id in tutor_ids:
+        for _ in range(profile_rows):
+            details[Experience].append({
+                'tutor_id': tutor_id, 'title': 'Teacher', 'institution': 'School',
+                'experience_file': _certificate(rng)})
+            details[Qualification].append({
+                'tutor_id': tutor_id, 'qualification': 'Degree', 'institution': 'University',
+                'qualification_date': str(rng.randrange(2000, 2021)), 'qualification_file': _certificate(rng)})
+            details[Achievement].append({
+                'tutor_id': tutor_id, 'achievement': 'Award', 'awarded_by': 'Board',
+                'achievement_file': _certificate(rng)})
+
+    _insert(connection, User.__table__, users)
+    _insert(connection, Tutor.__table__, profiles['tutor'])
+    _insert(connection, Student.__table__, profiles['student'])
+    _insert(connection, Location.__table__, locations)
+    _insert(connection, Mycourse.__table__, mycourses)
+    _insert(connection, followers, follows)
+    for model, rows in details.items():
+        _insert(connection, model.__table__, rows)
+    # the search order column is derived from the offerings just written
+    refresh_min_costs(connection)
+    return {
+        'user': len(users), 'course': courses, 'mycourse': len(mycourses),
+        'followers': len(follows), 'experience': len(details[Experience]),
+    }
+
+
+def rebuild_derived():
+    """ Fill the tables the flush hooks normally maintain """
+    from app.fulltext import rebuild_index
+    from app.matching import rebuild_matches
+    from app.recommend import build_recommendations
+    rebuild_index()
+    rebuild_matches()
+    build_recommendations()
@@ -0,0 +1,46 @@
+"""follow counters
+
+Revision ID: 5e2a9c7f3d18
+Revises: d4f08b6e1a93
+Create Date: 2026-10-18 13:15:40.562391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a9c7f3d18'
+down_revision = 'd4f08b6e1a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    # duplicate follow rows would break the unique index
+    row_id = 'ctid' if op.get_bind().dialect.name == 'postgresql' else 'rowid'
+    op.execute(
+        "DELETE FROM followers WHERE {0} NOT IN ("
+        "SELECT min({0}) FROM followers GROUP BY follower_id, followed_id)".format(row_id)
+    )
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.create_index('ix_followers_follower_id_followed_id', ['follower_id', 'followed_id'], unique=True)
+
+    op.execute(
+        'UPDATE "user" SET '
+        'follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+        'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_follower_id_followed_id')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
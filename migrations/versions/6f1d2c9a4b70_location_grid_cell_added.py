@@ -0,0 +1,62 @@
+"""location grid cell added
+
+Revision ID: 6f1d2c9a4b70
+Revises: f041042f102d
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from math import floor
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f1d2c9a4b70'
+down_revision = 'f041042f102d'
+branch_labels = None
+depends_on = None
+
+# Mirrors app.geo so the migration does not depend on application imports.
+GRID_CELL_DEGREES = 0.05
+GRID_COLUMNS = int(360 / GRID_CELL_DEGREES)
+
+
+def grid_cell(lat, lng):
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    row = int(floor((lat + 90) / GRID_CELL_DEGREES))
+    column = int(floor((lng + 180) / GRID_CELL_DEGREES)) % GRID_COLUMNS
+    return row * GRID_COLUMNS + column
+
+
+def upgrade():
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('grid_cell', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_location_grid_cell'), ['grid_cell'], unique=False)
+
+    connection = op.get_bind()
+    location = sa.table(
+        'location',
+        sa.column('user_id', sa.Integer),
+        sa.column('latitude', sa.Float),
+        sa.column('longitude', sa.Float),
+        sa.column('grid_cell', sa.Integer),
+    )
+    rows = connection.execute(
+        sa.select([location.c.user_id, location.c.latitude, location.c.longitude])
+    ).fetchall()
+    for user_id, latitude, longitude in rows:
+        connection.execute(
+            location.update()
+            .where(location.c.user_id == user_id)
+            .values(grid_cell=grid_cell(latitude, longitude))
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('location', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_location_grid_cell'))
+        batch_op.drop_column('grid_cell')
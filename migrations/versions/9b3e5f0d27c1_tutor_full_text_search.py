@@ -0,0 +1,49 @@
+"""tutor full text search
+
+Revision ID: 9b3e5f0d27c1
+Revises: 6f1d2c9a4b70
+Create Date: 2026-10-18 11:04:52.771930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5f0d27c1'
+down_revision = '6f1d2c9a4b70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 is SQLite only; other backends fall back to plain queries.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tutor_search USING fts5("
+        "username, full_name, description, courses, qualifications, experiences, achievements, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    op.execute(
+        "INSERT INTO tutor_search (rowid, username, full_name, description, courses, "
+        "qualifications, experiences, achievements) "
+        "SELECT user.id, coalesce(user.username, ''), coalesce(tutor.full_name, ''), "
+        "coalesce(tutor.description, ''), "
+        "coalesce((SELECT group_concat(coalesce(course.course_title, '') || ' ' || "
+        "coalesce(course.course_description, ''), ' ') FROM mycourse "
+        "JOIN course ON course.id = mycourse.course_id WHERE mycourse.user_id = user.id), ''), "
+        "coalesce((SELECT group_concat(qualification, ' ') FROM qualification "
+        "WHERE qualification.tutor_id = user.id), ''), "
+        "coalesce((SELECT group_concat(title, ' ') FROM experience "
+        "WHERE experience.tutor_id = user.id), ''), "
+        "coalesce((SELECT group_concat(achievement, ' ') FROM achievement "
+        "WHERE achievement.tutor_id = user.id), '') "
+        "FROM user JOIN tutor ON tutor.user_id = user.id"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TABLE IF EXISTS tutor_search")
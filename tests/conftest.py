@@ -0,0 +1,87 @@
+import os
+import tempfile
+from datetime import time
+
+import pytest
+
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='fyt-test-'), 'test.db')
+os.environ.pop('MAIL_QUEUE_SCHEDULER', None)
+
+from app import app as flask_app, db  # noqa: E402
+from app.models import User, Student, Tutor, Location, Course, Mycourse  # noqa: E402
+from app.passwords import hash_password  # noqa: E402
+
+
+PASSWORD = 'secret1'
+TUTORS = 60
+STUDENTS = 40
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, MAIL_SUPPRESS_SEND=True)
+    # no app context stays pushed: each request gets its own, and with it
+    # its own `g`
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+
+@pytest.fixture(scope='session')
+def seeded(app):
+    """
+    TUTORS tutors teaching two courses around Kathmandu and STUDENTS
+    students: s0 follows every tutor, and every student follows t0
+    """
+    with app.app_context():
+        return _seed()
+
+
+def _seed():
+    # one hash for everyone: the KDF is slow on purpose
+    password = hash_password(PASSWORD)
+    courses = [
+        Course(course_title='Maths', course_level='Bachelor Level', course_description='calculus'),
+        Course(course_title='Physics', course_level='Master Level', course_description='quantum'),
+    ]
+    db.session.add_all(courses)
+    tutors = []
+    for index in range(TUTORS):
+        tutor = User(username='t{0}'.format(index), email='t{0}@example.com'.format(index), role='tutor',
+            confirmed_account=True, hash_password=password)
+        tutor.tutor = Tutor(full_name='Tutor {0}'.format(index), district='Kathmandu')
+        tutor.location = Location(latitude=27.7 + index * 0.001, longitude=85.3 + index * 0.001)
+        db.session.add(tutor)
+        db.session.add(Mycourse(User=tutor, Course=courses[index % 2], time=time(7), endtime=time(8),
+            cost=1000 * (1 + index % 9)))
+        tutors.append(tutor)
+    students = []
+    for index in range(STUDENTS):
+        student = User(username='s{0}'.format(index), email='s{0}@example.com'.format(index), role='student',
+            confirmed_account=True, hash_password=password)
+        student.student = Student(full_name='Student {0}'.format(index))
+        student.location = Location(latitude=27.7, longitude=85.3)
+        db.session.add(student)
+        db.session.add(Mycourse(User=student, Course=courses[0], time=time(7, 30), endtime=time(8, 30),
+            cost=5000))
+        students.append(student)
+    db.session.commit()
+    for tutor in tutors:
+        students[0].follow(tutor)
+    for student in students[1:]:
+        student.follow(tutors[0])
+    db.session.commit()
+    return {'tutors': [tutor.id for tutor in tutors], 'students': [student.id for student in students]}
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    yield client
+    client.get('/logout')
+
+
+def login(client, email):
+    response = client.post('/login', data={'email': email, 'password': PASSWORD})
+    assert response.status_code == 302
@@ -0,0 +1,21 @@
+import pytest
+
+from app.geo import haversine, nearest_tutors
+from app.models import User
+
+
+@pytest.mark.parametrize('radius_km, limit', [(0.5, 100), (3, 100), (3, 5), (50, 100)])
+def test_nearest_tutors_matches_a_full_scan(app, seeded, radius_km, limit):
+    with app.app_context():
+        expected = sorted(
+            (haversine(27.7, 85.3, tutor.location.latitude, tutor.location.longitude), tutor.id)
+            for tutor in User.query.filter_by(role='tutor')
+        )
+        expected = [(user_id, distance) for distance, user_id in expected if distance <= radius_km][:limit]
+        found = [(tutor.id, distance) for tutor, distance in nearest_tutors(27.7, 85.3, radius_km, limit)]
+    assert found == pytest.approx(expected)
+
+
+def test_nearest_tutors_without_a_location(app):
+    with app.app_context():
+        assert nearest_tutors(None, None) == []
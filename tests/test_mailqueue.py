@@ -0,0 +1,100 @@
+import socket
+
+import pytest
+
+from flask_mail import Message
+
+from app import db
+from app.mailqueue import drain, enqueue
+from app.email import send_announcements_mail
+from app.models import MailJob, Broadcast
+from conftest import TUTORS, STUDENTS
+
+controller = pytest.importorskip('aiosmtpd.controller')
+
+
+class Inbox:
+    """ aiosmtpd handler keeping every envelope it accepts """
+
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return '250 OK'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    """ Flask-Mail pointed at a local SMTP server, and its inbox """
+    inbox = Inbox()
+    server = controller.Controller(inbox, hostname='127.0.0.1', port=_free_port())
+    server.start()
+    state = app.extensions['mail']
+    monkeypatch.setattr(state, 'server', '127.0.0.1')
+    monkeypatch.setattr(state, 'port', server.port)
+    monkeypatch.setattr(state, 'use_ssl', False)
+    monkeypatch.setattr(state, 'suppress', False)
+    monkeypatch.setitem(app.config, 'MAIL_SENDER', 'FYT Admin <admin@example.com>')
+    yield inbox
+    server.stop()
+    with app.app_context():
+        MailJob.query.delete()
+        Broadcast.query.delete()
+        db.session.commit()
+
+
+def _message():
+    msg = Message('Hello', sender='FYT Admin <admin@example.com>', recipients=['someone@example.com'])
+    msg.body = 'hello'
+    return msg
+
+
+def test_enqueue_leaves_the_commit_to_the_caller(app, smtp):
+    with app.app_context():
+        enqueue(_message())
+        db.session.rollback()
+        assert MailJob.query.count() == 0
+
+
+def test_queued_mail_is_sent_by_the_worker(app, smtp):
+    with app.app_context():
+        enqueue(_message())
+        db.session.commit()
+        # nothing is sent until the worker drains the queue
+        assert smtp.envelopes == []
+        drain()
+        assert MailJob.query.one().status == 'sent'
+    assert [envelope.rcpt_tos for envelope in smtp.envelopes] == [['someone@example.com']]
+
+
+def test_broadcast_reaches_every_user_in_chunks(app, seeded, smtp, monkeypatch):
+    monkeypatch.setitem(app.config, 'BROADCAST_CHUNK_SIZE', 30)
+    # no pause between chunks
+    monkeypatch.setitem(app.config, 'BROADCAST_MAX_PER_MINUTE', 10 ** 9)
+    with app.app_context():
+        send_announcements_mail('Holiday', 'No classes on Friday.')
+        db.session.commit()
+        drain()
+        broadcast = Broadcast.query.one()
+        assert broadcast.status == 'sent'
+        assert broadcast.sent_count == TUTORS + STUDENTS
+    chunks = [len(envelope.rcpt_tos) for envelope in smtp.envelopes]
+    assert chunks == [30] * ((TUTORS + STUDENTS) // 30) + [(TUTORS + STUDENTS) % 30]
+
+
+def test_failed_sends_back_off(app, smtp, monkeypatch):
+    monkeypatch.setattr(app.extensions['mail'], 'port', _free_port())
+    with app.app_context():
+        enqueue(_message())
+        db.session.commit()
+        drain()
+        job = MailJob.query.one()
+        assert (job.status, job.attempts) == ('pending', 1)
+        assert job.last_error
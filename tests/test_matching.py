@@ -0,0 +1,39 @@
+import pytest
+
+from app import db
+from app.geo import haversine
+from app.matching import rebuild_matches
+from app.models import User, CourseMatch
+
+
+def _distances():
+    users = {user.id: user for user in User.query.all()}
+    found, expected = [], []
+    for match in CourseMatch.query.order_by(CourseMatch.id):
+        student, tutor = users[match.student_id].location, users[match.tutor_id].location
+        found.append(match.distance_km)
+        expected.append(haversine(student.latitude, student.longitude, tutor.latitude, tutor.longitude))
+    return found, expected
+
+
+def test_match_distances_agree_with_the_scalar_haversine(app, seeded):
+    with app.app_context():
+        # as kept up to date by the flush hook, then rebuilt in bulk
+        for _ in range(2):
+            found, expected = _distances()
+            assert found and found == pytest.approx(expected)
+            rebuild_matches()
+
+
+def test_match_distance_is_unset_without_a_location(app, seeded):
+    with app.app_context():
+        student = User.query.filter_by(username='s1').one()
+        latitude = student.location.latitude
+        student.location.latitude = None
+        db.session.commit()
+        try:
+            matches = CourseMatch.query.filter_by(student_id=student.id).all()
+            assert matches and all(match.distance_km is None for match in matches)
+        finally:
+            student.location.latitude = latitude
+            db.session.commit()
@@ -0,0 +1,51 @@
+import hashlib
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app.passwords import hash_password, verify_password
+
+
+PASSWORD = 'correct horse battery staple'
+
+
+def _werkzeug_scrypt(password, salt='Gm9fFpYbXwCkQ2sT', n=2 ** 14, r=8, p=1):
+    """ A hash as werkzeug 2.3+ writes it: scrypt with hashlib's 64 byte key """
+    try:
+        return generate_password_hash(password, method='scrypt:{0}:{1}:{2}'.format(n, r, p))
+    except (TypeError, ValueError):
+        # this werkzeug predates scrypt; build the same string it would
+        key = hashlib.scrypt(password.encode('utf-8'), salt=salt.encode('utf-8'), n=n, r=r, p=p,
+            maxmem=132 * n * r * p)
+        return 'scrypt:{0}:{1}:{2}${3}${4}'.format(n, r, p, salt, key.hex())
+
+
+def test_own_hashes_verify(app):
+    stored = hash_password(PASSWORD)
+    assert verify_password(stored, PASSWORD)
+    assert not verify_password(stored, PASSWORD + '!')
+
+
+@pytest.mark.parametrize('stored', [
+    generate_password_hash(PASSWORD),
+    generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000'),
+    generate_password_hash(PASSWORD, method='sha256'),
+    _werkzeug_scrypt(PASSWORD),
+], ids=['default', 'pbkdf2', 'salted-sha256', 'scrypt'])
+def test_werkzeug_hashes_verify(app, stored):
+    assert verify_password(stored, PASSWORD)
+    assert not verify_password(stored, PASSWORD + '!')
+
+
+@pytest.mark.parametrize('stored', [
+    'pbkdf2:sha256:abc$salt$00ff',
+    'pbkdf2:nosuchdigest:1000$salt$00ff',
+    'scrypt:16384:8$salt$00ff',
+    'scrypt:3:8:1$salt$00ff',
+    'scrypt:16384:8:1$salt$',
+    'pbkdf2:sha256:1000$salt$éé',
+    '',
+    None,
+])
+def test_malformed_hashes_fail_the_check(app, stored):
+    assert verify_password(stored, PASSWORD) is False
@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from conftest import TUTORS, login
+
+
+@contextmanager
+def statements():
+    """ The SQL statements executed inside the block """
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield executed
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+# every page lists dozens of users; an N+1 load would issue one or more
+# statements per listed user
+@pytest.mark.parametrize('email, path, ceiling', [
+    ('s0@example.com', '/student', 8),
+    ('s0@example.com', '/student/search-tutors?per_page=50', 10),
+    ('s0@example.com', '/student/my-tutors', 8),
+    ('s0@example.com', '/profiles/t0', 15),
+    ('t0@example.com', '/tutor/my-followers', 6),
+])
+def test_statements_per_page(client, seeded, email, path, ceiling):
+    login(client, email)
+    # the first request fills per-process caches
+    assert client.get(path).status_code == 200
+    with statements() as executed:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert len(executed) <= ceiling, '\n\n'.join(executed)
+
+
+def test_search_statements_do_not_grow_with_page_size(client, seeded):
+    login(client, 's0@example.com')
+    counts = []
+    for per_page in (5, TUTORS):
+        client.get('/student/search-tutors?per_page={0}'.format(per_page))
+        with statements() as executed:
+            assert client.get('/student/search-tutors?per_page={0}'.format(per_page)).status_code == 200
+        counts.append(len(executed))
+    assert counts[0] == counts[1]
@@ -1,4 +1,9 @@
 from app import app 
+from app.mailqueue import start_scheduler
+
+# without a separate mail worker, send queued mail from the web processes
+if app.config.get('MAIL_QUEUE_SCHEDULER'):
+    start_scheduler()
   
 if __name__ == "__main__": 
     app.run() 